@@ -0,0 +1,41 @@
+"""
+Section/query embedding helpers shared by the AI service and the embedding
+backfill (scripts/embed_sections.py)
+
+Vectors written by the backfill and vectors searched with at query time must
+come from the same model and be quantized the same way, so both sides build
+them here.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
+
+EMBEDDING_MODEL = "textembedding-gecko@003"
+EMBEDDING_DIM = 768
+
+def load_embedding_model() -> TextEmbeddingModel:
+    """The embedding model; call after vertexai.init."""
+    return TextEmbeddingModel.from_pretrained(EMBEDDING_MODEL)
+
+def embed_texts(model: TextEmbeddingModel, texts: List[str], task_type: str) -> List[List[float]]:
+    """Embeddings for texts in one request; task_type is RETRIEVAL_DOCUMENT or RETRIEVAL_QUERY."""
+    response = model.get_embeddings([TextEmbeddingInput(text, task_type) for text in texts])
+    return [embedding.values for embedding in response]
+
+def embed_documents(model: TextEmbeddingModel, texts: List[str],
+                    batch_size: int = 50, concurrency: int = 8) -> List[List[float]]:
+    """Document embeddings for texts, batch_size per request with up to concurrency requests in flight."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        responses = pool.map(lambda batch: embed_texts(model, batch, "RETRIEVAL_DOCUMENT"), batches)
+        return [vector for vectors in responses for vector in vectors]
+
+def pack_embedding_bits(embedding: List[float]) -> bytes:
+    """1 bit per dimension (above the vector's mean), packed big-endian like numpy.packbits."""
+    mean = sum(embedding) / len(embedding)
+    bits = 0
+    for value in embedding:
+        bits = (bits << 1) | (value > mean)
+    return bits.to_bytes((len(embedding) + 7) // 8, "big")
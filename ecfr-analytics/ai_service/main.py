@@ -5,49 +5,583 @@ Provides conversational AI interface with full regulatory context
 
 import os
 import re
-from typing import List, Dict, Any
+import json
+import logging
+import asyncio
+import bisect
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Hashable, AsyncIterator, Optional, Tuple
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, date as date_type
 
+import anyio
+import google.auth
 import vertexai
+from google.auth.transport.requests import AuthorizedSession
+from requests.adapters import HTTPAdapter
 from vertexai.generative_models import GenerativeModel
-from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
+from google.api_core.exceptions import BadRequest, Forbidden, TooManyRequests
 from google.cloud import bigquery
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from embeddings import EMBEDDING_DIM, embed_texts, load_embedding_model, pack_embedding_bits
+
+# The local Gemini tokenizer needs the sentencepiece extra; without it prompt
+# sizes are estimated from character counts
+try:
+    from vertexai.preview.tokenization import get_tokenizer_for_model
+except ImportError:
+    get_tokenizer_for_model = None
+
+# orjson is optional; fall back to the stdlib encoder where it isn't installed
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as DefaultJSONResponse
+
+    def dumps_json(data: Any) -> str:
+        return orjson.dumps(data).decode()
+except ImportError:
+    DefaultJSONResponse = JSONResponse
+
+    def dumps_json(data: Any) -> str:
+        return json.dumps(data)
+
 load_dotenv()
 
+# Configure logging; set LOG_LEVEL=DEBUG to see per-request search diagnostics
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 # Initialize Vertex AI
 PROJECT_ID = os.getenv("PROJECT_ID", "lawscan")
 REGION = os.getenv("REGION", "us-central1")
 DATASET = os.getenv("DATASET", "ecfr_enhanced")
 TABLE = os.getenv("TABLE", "sections_enhanced")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "64"))
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "http://localhost:8080").split(",") if o.strip()]
 
 if not PROJECT_ID:
     raise RuntimeError("PROJECT_ID environment variable is required")
 
-vertexai.init(project=PROJECT_ID, location=REGION)
+INIT_MAX_ATTEMPTS = int(os.getenv("INIT_MAX_ATTEMPTS", "5"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2048"))
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "300"))
+SEARCH_BATCH_MAX = int(os.getenv("SEARCH_BATCH_MAX", "16"))  # 1 disables coalescing
+SEARCH_BATCH_HOLD_MS = int(os.getenv("SEARCH_BATCH_HOLD_MS", "15"))
+QUERY_EMBEDDING_BATCH_MAX = int(os.getenv("QUERY_EMBEDDING_BATCH_MAX", "16"))  # 1 disables coalescing
+QUERY_EMBEDDING_HOLD_MS = int(os.getenv("QUERY_EMBEDDING_HOLD_MS", "10"))
+# Off until scripts/embed_sections.py has filled the embeddings and sections_vec_idx exists
+VECTOR_SEARCH_ENABLED = os.getenv("VECTOR_SEARCH_ENABLED", "false").lower() == "true"
+VECTOR_SEARCH_FRACTION = float(os.getenv("VECTOR_SEARCH_FRACTION", "0.01"))  # IVF lists probed per query
+VECTOR_SEARCH_QUANTIZED = os.getenv("VECTOR_SEARCH_QUANTIZED", "false").lower() == "true"
+QUANTIZED_CANDIDATES = int(os.getenv("QUANTIZED_CANDIDATES", "500"))  # Hamming shortlist reranked by cosine
+GENERATIVE_MODEL = os.getenv("GENERATIVE_MODEL", "gemini-1.5-pro")
+FAST_GENERATIVE_MODEL = os.getenv("FAST_GENERATIVE_MODEL", "gemini-1.5-flash")
+# Questions go to the fast model unless the built prompt is long or the context high-burden
+PRO_PROMPT_TOKENS = int(os.getenv("PRO_PROMPT_TOKENS", "3000"))
+PRO_BURDEN_SCORE = float(os.getenv("PRO_BURDEN_SCORE", "70"))
+MAX_CONTEXT_TOKENS = int(os.getenv("MAX_CONTEXT_TOKENS", "6000"))  # Whole prompt, including the question
+CHARS_PER_TOKEN = 4  # Estimate used when the tokenizer isn't available
+
+# Clients are created at startup (see init_clients) so importing this module
+# never blocks on Vertex AI / BigQuery network calls
+bq_client = None
+embedding_model = None
+generative_model = None
+fast_generative_model = None
+prompt_tokenizer = None
+
+def init_clients():
+    """Initialize Vertex AI and the BigQuery/embedding/generative clients."""
+    global bq_client, embedding_model, generative_model, fast_generative_model, prompt_tokenizer
+    # gRPC keeps one long-lived channel per client for all generation calls
+    vertexai.init(project=PROJECT_ID, location=REGION, api_transport="grpc")
+    
+    # requests pools 10 connections per host by default; size the pool to the
+    # thread pool so concurrent queries reuse warm TLS connections
+    credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+    http = AuthorizedSession(credentials)
+    http.mount("https://", HTTPAdapter(pool_maxsize=THREADPOOL_SIZE))
+    bq_client = bigquery.Client(project=PROJECT_ID, credentials=credentials, _http=http)
+    embedding_model = load_embedding_model()
+    if get_tokenizer_for_model is not None and prompt_tokenizer is None:
+        try:
+            prompt_tokenizer = get_tokenizer_for_model("gemini-1.5-pro")
+        except Exception as e:
+            logger.warning("Gemini tokenizer unavailable, estimating prompt tokens: %s", e)
+    fast_generative_model = GenerativeModel(FAST_GENERATIVE_MODEL)
+    generative_model = GenerativeModel(GENERATIVE_MODEL)
+
+def clients_ready() -> bool:
+    """True once init_clients has completed successfully."""
+    return generative_model is not None
+
+def count_tokens(text: str) -> int:
+    """Gemini token count for text, or a character-based estimate without the tokenizer."""
+    if prompt_tokenizer is not None:
+        return prompt_tokenizer.count_tokens(text).total_tokens
+    return len(text) // CHARS_PER_TOKEN + 1
+
+# Prompt scaffolding is fixed; only the retrieved context and question vary per request
+SYSTEM_PROMPT = """You are an expert regulatory analyst specializing in the Code of Federal Regulations (CFR). Provide comprehensive analysis with specific citations, burden scores, and practical compliance guidance."""
+RAG_PROMPT_TEMPLATE = SYSTEM_PROMPT + "\n\nREGULATORY CONTEXT:\n{context}\n\nUSER QUESTION: {query}\n\nProvide a comprehensive answer with specific citations and burden analysis."
+
+# Query analysis vocabulary and patterns, compiled once at import
+REGULATORY_CONCEPTS = {
+    'compliance': ('compliance', 'conform', 'adhere', 'meet', 'satisfy'),
+    'safety': ('safety', 'hazard', 'danger', 'risk', 'secure', 'protection'),
+    'environment': ('environment', 'pollution', 'emission', 'waste', 'air', 'water', 'soil', 'contamination'),
+    'enforcement': ('penalty', 'fine', 'violation', 'enforce', 'sanction', 'punishment', 'citation'),
+    'requirement': ('requirement', 'must', 'shall', 'required', 'mandatory', 'obligation'),
+    'prohibition': ('prohibition', 'prohibited', 'forbidden', 'banned', 'not permitted', 'shall not'),
+    'disclosure': ('disclosure', 'report', 'notify', 'inform', 'submit', 'file'),
+    'ethical': ('ethical', 'ethics', 'conduct', 'conflict', 'integrity', 'standards'),
+    'financial': ('financial', 'cost', 'fee', 'payment', 'dollar', 'money', 'budget'),
+    'management': ('management', 'administration', 'oversight', 'supervision', 'control'),
+    'security': ('security', 'classified', 'confidential', 'access', 'clearance'),
+    'training': ('training', 'education', 'instruction', 'course', 'program')
+}
+SEARCH_FOLLOWUP_INDICATORS = ('tell me more', 'more about', 'it', 'that', 'this', 'details', 'summary', 'elaborate')
+FOLLOWUP_INDICATORS = (
+    'tell me more', 'more about', 'explain that', 'what about', 'how about',
+    'details', 'summary', 'elaborate', 'clarify', 'it', 'that', 'this',
+    'what does it', 'how does it', 'why does it', 'when does it'
+)
+SUMMARY_KEYWORDS = ('summary', 'summarize', 'simple', 'brief', 'short', 'one line', 'tldr', 'essence', 'gist')
+DETAIL_KEYWORDS = ('more', 'detail', 'elaborate', 'explain', 'tell me about', 'describe', 'how', 'why', 'what')
+# Upper bounds (inclusive) of each burden level; scores above the last are Critical
+BURDEN_THRESHOLDS = (25.0, 50.0, 75.0)
+BURDEN_LEVELS = ("Low Risk", "Moderate Risk", "High Risk", "Critical Risk")
+REQUIREMENT_TERMS = ('requirement', 'must', 'shall', 'required')
+ENFORCEMENT_TERMS = ('penalty', 'fine', 'violation', 'enforcement')
+
+def _keyword_re(terms) -> re.Pattern:
+    """One alternation over all terms, so a single scan answers 'does any term occur'."""
+    return re.compile("|".join(re.escape(term) for term in sorted(terms, key=len, reverse=True)))
+
+_SEARCH_FOLLOWUP_RE = _keyword_re(SEARCH_FOLLOWUP_INDICATORS)
+_FOLLOWUP_RE = _keyword_re(FOLLOWUP_INDICATORS)
+_SUMMARY_RE = _keyword_re(SUMMARY_KEYWORDS)
+_DETAIL_RE = _keyword_re(DETAIL_KEYWORDS)
+_REQUIREMENT_RE = _keyword_re(REQUIREMENT_TERMS)
+_ENFORCEMENT_RE = _keyword_re(ENFORCEMENT_TERMS)
+
+# Concept detection walks the query once: the lookahead reports the longest term
+# starting at every position, and each term maps to the concepts of every term
+# it contains, so shorter overlapping terms (e.g. 'shall' in 'shall not') still count.
+_CONCEPT_TERMS = {term for terms in REGULATORY_CONCEPTS.values() for term in terms}
+_CONCEPTS_BY_TERM = {
+    term: {concept for concept, terms in REGULATORY_CONCEPTS.items() if any(t in term for t in terms)}
+    for term in _CONCEPT_TERMS
+}
+_CONCEPT_RE = re.compile(f"(?=({_keyword_re(_CONCEPT_TERMS).pattern}))")
+
+def detect_concepts(query_lower: str) -> List[str]:
+    """Concepts with any term occurring in the query, in REGULATORY_CONCEPTS order."""
+    found = set()
+    for term in _CONCEPT_RE.findall(query_lower):
+        found |= _CONCEPTS_BY_TERM[term]
+    return [concept for concept in REGULATORY_CONCEPTS if concept in found]
+
+_CFR_QUERY_RE = re.compile(r'(?:title\s+)?(\d+)\s+cfr\s+(?:part\s+)?(\d+)(?:\.(\d+))?', re.IGNORECASE)
+_CFR_PREV_RE = re.compile(r'(\d+\s+CFR\s+§\s+[\d.]+[A-Za-z]*(?:-[\d.]+[A-Za-z]*)?)')
+
+# Keyword search SQL is built once per query shape so every request with the same
+# shape sends identical text (only parameters differ), which keeps BigQuery's
+# result cache effective. Keyed by (concept groups, query words, CFR match, section,
+# search index). Text terms use SEARCH() against the search index on
+# section_text/section_heading/ai_context_summary (infra/sections_enhanced.sql); the LIKE variant is
+# the fallback when SEARCH is rejected or over quota.
+MAX_CONCEPT_GROUPS = 3
+TERMS_PER_CONCEPT = 2
+_CONCEPT_TOP_TERMS = {concept: terms[:TERMS_PER_CONCEPT] for concept, terms in REGULATORY_CONCEPTS.items()}
+MAX_QUERY_WORDS = 5
+# Questions shorter than this with no citation, concept or word over 2 chars get
+# suggestions instead of a whole-query scan
+MIN_UNTERMED_QUERY_WORDS = 4
+# Chat queries read the 1000-char section_text_preview written at ingest
+# instead of the full text; prompts pack as many previews as fit the token budget
+SECTION_PREVIEW_CHARS = 1000
+
+# Same normalization the ingest jobs apply to section_heading_norm, so the
+# heading relevance check is a plain substring test with no per-row LOWER
+_HEADING_NORM_RE = re.compile(r"[^a-z0-9 ]")
+
+def normalize_heading(text_lower: str) -> str:
+    """Lowercased text with everything but letters, digits and spaces removed."""
+    return _HEADING_NORM_RE.sub("", text_lower)
+
+def has_searchable_terms(query_lower: str) -> bool:
+    """Whether the keyword search would find a citation, concept or query word to match on."""
+    words = query_lower.split()
+    return (len(words) >= MIN_UNTERMED_QUERY_WORDS
+            or any(len(word) > 2 for word in words)
+            or _CFR_QUERY_RE.search(query_lower) is not None
+            or bool(detect_concepts(query_lower)))
+
+def _text_match(param_name: str, use_search: bool) -> str:
+    if use_search:
+        return f"SEARCH((section_text, section_heading, ai_context_summary), @{param_name})"
+    return f"(text_lc LIKE @{param_name} OR heading_lc LIKE @{param_name})"
+
+def _build_keyword_search_sql(num_concepts: int, num_words: int, has_cfr: bool, has_section: bool, use_search: bool) -> str:
+    # Partition/cluster predicates (and index-backed SEARCH) go in the CTE so BigQuery
+    # prunes before any text is lowercased; LIKE predicates and scoring reuse the
+    # lowercased columns.
+    scan_conditions = ["version_date = @date"]
+    match_conditions = []
+    if has_cfr:
+        scan_conditions.append("title_num = @title")
+        scan_conditions.append("part_num = @part")
+        if has_section:
+            scan_conditions.append("section_num = @section")
+    else:
+        search_conditions = [
+            f"({' OR '.join(_text_match(f'concept{i}_{j}', use_search) for j in range(TERMS_PER_CONCEPT))})"
+            for i in range(num_concepts)
+        ]
+        search_conditions.extend(_text_match(f"word{i}", use_search) for i in range(num_words))
+        if not search_conditions:
+            # Ultimate fallback: search entire query
+            search_conditions.append(_text_match("query", use_search))
+        (scan_conditions if use_search else match_conditions).append(f"({' OR '.join(search_conditions)})")
+    
+    return f"""
+        WITH candidates AS (
+            SELECT 
+                section_citation,
+                title_num,
+                part_num,
+                agency_name,
+                section_heading,
+                section_text_preview AS section_text,
+                regulatory_burden_score,
+                prohibition_count,
+                requirement_count,
+                enforcement_terms,
+                ai_context_summary,
+                word_count,
+                LOWER(section_heading) AS heading_lc,
+                LOWER(section_text) AS text_lc,
+                section_heading_norm
+            FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+            WHERE {' AND '.join(scan_conditions)}
+        )
+        SELECT 
+            * EXCEPT (heading_lc, text_lc, section_heading_norm),
+            -- Enhanced relevance scoring with multiple factors
+            (
+                CASE WHEN STRPOS(section_heading_norm, @query_norm) > 0 THEN 15 ELSE 0 END +
+                CASE WHEN STRPOS(text_lc, @query_text) > 0 THEN 10 ELSE 0 END +
+                CASE WHEN regulatory_burden_score > 50 THEN 5 ELSE 0 END +
+                CASE WHEN prohibition_count > 0 THEN 3 ELSE 0 END +
+                CASE WHEN requirement_count > 2 THEN 2 ELSE 0 END +
+                CASE WHEN enforcement_terms > 0 THEN 4 ELSE 0 END +
+                CASE WHEN word_count > 100 THEN 2 ELSE 1 END
+            ) as relevance_score
+        FROM candidates
+        {f"WHERE {' AND '.join(match_conditions)}" if match_conditions else ""}
+        ORDER BY relevance_score DESC, regulatory_burden_score DESC
+        LIMIT @limit
+        """
+
+_SQL_TEMPLATES = {
+    (num_concepts, num_words, False, False, use_search): _build_keyword_search_sql(num_concepts, num_words, False, False, use_search)
+    for num_concepts in range(MAX_CONCEPT_GROUPS + 1)
+    for num_words in range(MAX_QUERY_WORDS + 1)
+    for use_search in (False, True)
+}
+_SQL_TEMPLATES.update({
+    # CFR lookups filter on clustered columns only, so both variants share one SQL
+    (0, 0, True, has_section, use_search): _build_keyword_search_sql(0, 0, True, has_section, False)
+    for has_section in (False, True)
+    for use_search in (False, True)
+})
+
+_SEARCH_SYNTAX_RE = re.compile(r'[`\\]')
+
+def search_term_params(text_terms: Dict[str, str], use_search: bool) -> List[bigquery.ScalarQueryParameter]:
+    """Bind search terms as SEARCH() queries or as LIKE substring patterns."""
+    if use_search:
+        # Backticks and backslashes are SEARCH query syntax, not text
+        return [bigquery.ScalarQueryParameter(name, "STRING", _SEARCH_SYNTAX_RE.sub(" ", term))
+                for name, term in text_terms.items()]
+    return [bigquery.ScalarQueryParameter(name, "STRING", f"%{term}%") for name, term in text_terms.items()]
+
+_PARAM_RE = re.compile(r'@(\w+)')
+
+def run_keyword_searches(searches: List[tuple]) -> List[list]:
+    """Run keyword searches, each (shape, params, text_terms), as one BigQuery job.
+    
+    Returns the rows for each search in order. SEARCH() is tried first, then the
+    LIKE templates if BigQuery rejects it or it is over quota.
+    """
+    try:
+        return _query_keyword_searches(searches, use_search=True)
+    except (BadRequest, Forbidden, TooManyRequests) as e:
+        logger.warning("SEARCH() query failed, falling back to LIKE (%s): %s", type(e).__name__, e)
+        return _query_keyword_searches(searches, use_search=False)
+
+def _query_keyword_searches(searches: List[tuple], use_search: bool) -> List[list]:
+    if len(searches) == 1:
+        # A lone search sends its template unchanged so BigQuery's result cache applies
+        shape, params, text_terms = searches[0]
+        rows = bq_client.query_and_wait(
+            _SQL_TEMPLATES[shape + (use_search,)],
+            job_config=chat_query_config(params + search_term_params(text_terms, use_search))
+        )
+        return [list(rows)]
+    
+    # Each search keeps its own template with parameters renamed r<i>_*, tagged with
+    # rid so rows can be handed back to the right caller. rid goes last so
+    # RegulationContext.from_bq_row still sees the context columns first.
+    selects = []
+    all_params = []
+    for rid, (shape, params, text_terms) in enumerate(searches):
+        prefix = f"r{rid}_"
+        sql = _PARAM_RE.sub(lambda m: f"@{prefix}{m.group(1)}", _SQL_TEMPLATES[shape + (use_search,)])
+        selects.append(f"SELECT *, {rid} AS rid FROM ({sql})")
+        all_params.extend(
+            bigquery.ScalarQueryParameter(prefix + p.name, p.type_, p.value)
+            for p in params + search_term_params(text_terms, use_search)
+        )
+    sql = "\nUNION ALL\n".join(selects) + "\nORDER BY rid, relevance_score DESC, regulatory_burden_score DESC"
+    
+    results = [[] for _ in searches]
+    for row in bq_client.query_and_wait(sql, job_config=chat_query_config(all_params)):
+        results[row.get("rid")].append(row)
+    return results
+
+class MicroBatcher:
+    """Coalesces calls arriving within a short window into one run_batch(items) call.
+    
+    run_batch takes a list of items and returns one result per item, in order.
+    """
+    
+    def __init__(self, run_batch, max_batch: int, hold_ms: int, name: str):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.hold_seconds = hold_ms / 1000
+        self._loop = None
+        self._queue = None
+        self._tasks = set()
+        # Batches run on their own threads: callers block default-pool threads
+        # while they wait, so sharing that pool could starve the batch itself
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix=name)
+    
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._spawn(self._collect())
+    
+    def call(self, item: Any) -> Any:
+        """Blocking entry point for worker threads; runs directly when not batching."""
+        if self._loop is None or self.max_batch <= 1:
+            return self.run_batch([item])[0]
+        return asyncio.run_coroutine_threadsafe(self.submit(item), self._loop).result()
+    
+    async def submit(self, item: Any) -> Any:
+        future = self._loop.create_future()
+        await self._queue.put((item, future))
+        return await future
+    
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _collect(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.hold_seconds
+            while len(batch) < self.max_batch:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self._spawn(self._run(batch))
+    
+    async def _run(self, batch: list) -> None:
+        try:
+            results = await self._loop.run_in_executor(
+                self._executor, self.run_batch, [item for item, _ in batch]
+            )
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+class SearchBatcher(MicroBatcher):
+    """Coalesces keyword searches arriving within a short window into one BigQuery job."""
+    
+    def __init__(self, max_batch: int, hold_ms: int):
+        super().__init__(run_keyword_searches, max_batch, hold_ms, "search-batch")
+    
+    def search(self, shape: tuple, params: list, text_terms: Dict[str, str]) -> list:
+        return self.call((shape, params, text_terms))
 
-# Initialize clients
-bq_client = bigquery.Client(project=PROJECT_ID)
-embedding_model = TextEmbeddingModel.from_pretrained("textembedding-gecko@003")
-generative_model = GenerativeModel("gemini-1.0-pro")
+search_batcher = SearchBatcher(SEARCH_BATCH_MAX, SEARCH_BATCH_HOLD_MS)
 
-app = FastAPI(title="eCFR AI Assistant", version="1.0.0")
+# Follow-ups: the citation extract_previous_citations already parsed is looked up
+# with its title and part bound as parameters, so the clustered columns prune
+PREVIOUS_CITATION_SQL = f"""
+    SELECT 
+        section_citation, title_num, part_num, agency_name, section_heading, 
+        section_text_preview AS section_text, regulatory_burden_score, prohibition_count, requirement_count,
+        enforcement_terms, ai_context_summary, word_count
+    FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+    WHERE version_date = @date
+      AND title_num = @title
+      AND part_num = @part
+      AND section_citation = @citation
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY section_citation) = 1
+    """
 
-# CORS middleware
+# Approximate nearest-neighbour retrieval over the precomputed section embeddings
+# (infra/sections_enhanced.sql, scripts/embed_sections.py). The base query only
+# touches columns stored in sections_vec_idx, so the date filter runs inside the
+# IVF index; the payload is joined back for the top_k hits only. Snapshots not yet
+# backfilled have empty embeddings and are skipped.
+VECTOR_SEARCH_SQL = f"""
+    SELECT 
+        s.section_citation, s.title_num, s.part_num, s.agency_name, s.section_heading, 
+        s.section_text_preview AS section_text, s.regulatory_burden_score, s.prohibition_count, s.requirement_count,
+        s.enforcement_terms, s.ai_context_summary, s.word_count,
+        (1 - v.distance) * 100 AS relevance_score
+    FROM VECTOR_SEARCH(
+        (
+            SELECT version_date, section_citation, embedding
+            FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+            WHERE version_date = @date AND ARRAY_LENGTH(embedding) > 0
+        ),
+        'embedding',
+        (SELECT @embedding AS embedding),
+        top_k => @limit,
+        distance_type => 'COSINE',
+        options => '{{"fraction_lists_to_search": {VECTOR_SEARCH_FRACTION}}}'
+    ) v
+    JOIN `{PROJECT_ID}.{DATASET}.{TABLE}` s
+      ON s.version_date = @date AND s.section_citation = v.base.section_citation
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY s.section_citation ORDER BY v.distance) = 1
+    ORDER BY v.distance
+    """
+
+# Binary-quantized alternative: shortlist by Hamming distance on the packed sign
+# bits (96 bytes/section), then rerank only the shortlist by full cosine distance
+QUANTIZED_VECTOR_SEARCH_SQL = f"""
+    WITH shortlist AS (
+        SELECT section_citation
+        FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+        WHERE version_date = @date AND embedding_bits IS NOT NULL
+        ORDER BY BIT_COUNT(embedding_bits ^ @bits)
+        LIMIT @candidates
+    )
+    SELECT 
+        section_citation, title_num, part_num, agency_name, section_heading, 
+        section_text_preview AS section_text, regulatory_burden_score, prohibition_count, requirement_count,
+        enforcement_terms, ai_context_summary, word_count,
+        (1 - ML.DISTANCE(embedding, @embedding, 'COSINE')) * 100 AS relevance_score
+    FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+    WHERE version_date = @date
+      AND section_citation IN (SELECT section_citation FROM shortlist)
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY section_citation) = 1
+    ORDER BY relevance_score DESC
+    LIMIT @limit
+    """
+
+def chat_query_config(params: List[Any]) -> bigquery.QueryJobConfig:
+    """Job config shared by all chat lookups."""
+    return bigquery.QueryJobConfig(
+        query_parameters=params,
+        use_query_cache=True,
+        labels={"endpoint": "chat"},
+    )
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds."""
+    
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+def normalize_query(query_lower: str) -> str:
+    """Cache key form of an already-lowercased question: whitespace collapsed."""
+    return " ".join(query_lower.split())
+
+def query_hash(query: str) -> str:
+    """Compact cache key for a question, independent of case and spacing."""
+    return hashlib.blake2b(normalize_query(query.lower()).encode(), digest_size=16).hexdigest()
+
+# Identical questions are common; the TTL lets new daily versions show up
+search_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+query_embedding_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+# Generated answers, keyed by question + date + the sections the prompt used
+response_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL)
+
+app = FastAPI(title="eCFR AI Assistant", version="1.0.0", default_response_class=DefaultJSONResponse)
+
+# CORS middleware - the UI only sends JSON POSTs without cookies
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type"],
+    max_age=86400,  # let browsers cache preflights for a day
 )
 
-@dataclass
+# Chat answers are multi-KB of prose; compress anything past a small threshold
+app.add_middleware(GZipMiddleware, minimum_size=512)
+
+@dataclass(slots=True, frozen=True)
 class RegulationContext:
     """Represents a regulation section with full context for AI."""
     section_citation: str
@@ -62,301 +596,349 @@ class RegulationContext:
     enforcement_terms: int
     ai_context_summary: str
     relevance_score: float = 0.0
+    
+    @classmethod
+    def from_bq_row(cls, row, relevance_score: float = None) -> "RegulationContext":
+        """Build from a search row; the chat queries select these columns first, in field order."""
+        (citation, title_num, part_num, agency, heading, text, burden,
+         prohibitions, requirements, enforcement, summary, *_) = row.values()
+        if relevance_score is None:
+            relevance_score = row.get("relevance_score") or 0.0
+        return cls(
+            section_citation=citation or "",
+            title_num=title_num or 0,
+            part_num=part_num or "",
+            agency_name=agency or "Unknown",
+            section_heading=heading or "",
+            section_text=text or "",
+            regulatory_burden_score=burden or 0.0,
+            prohibition_count=prohibitions or 0,
+            requirement_count=requirements or 0,
+            enforcement_terms=enforcement or 0,
+            ai_context_summary=summary or "",
+            relevance_score=relevance_score
+        )
+
+class InsufficientQueryError(Exception):
+    """The question has nothing to search on, so neither BigQuery nor Gemini is called."""
 
 class ChatRequest(BaseModel):
     message: str
     conversation_history: List[Dict[str, str]] = []
-    date: str = "2025-08-22"
+    date: date_type = date_type(2025, 8, 22)
     max_context_sections: int = 5
 
 class ChatResponse(BaseModel):
     response: str
     sources: List[Dict[str, Any]]
     context_used: List[str]
+    model_tier: Optional[str] = None
+    suggestions: List[str] = []
+
+def embed_queries(queries: List[str]) -> List[List[float]]:
+    """RETRIEVAL_QUERY embeddings for several questions in one Vertex AI request."""
+    return embed_texts(embedding_model, queries, "RETRIEVAL_QUERY")
+
+# Concurrent chats embed their questions in a shared request
+query_embedding_batcher = MicroBatcher(embed_queries, QUERY_EMBEDDING_BATCH_MAX, QUERY_EMBEDDING_HOLD_MS, "embed-batch")
 
 class EmbeddingService:
     """Service for creating and searching embeddings."""
     
-    def __init__(self):
-        self.model = embedding_model
+    @property
+    def model(self):
+        return embedding_model
     
     def get_embeddings(self, texts: List[str]) -> List[List[float]]:
         """Get embeddings for a list of texts."""
         try:
-            inputs = [TextEmbeddingInput(text, "RETRIEVAL_DOCUMENT") for text in texts]
-            embeddings = self.model.get_embeddings(inputs)
-            return [embedding.values for embedding in embeddings]
+            return embed_texts(self.model, texts, "RETRIEVAL_DOCUMENT")
         except Exception as e:
-            print(f"Embedding error: {e}")
-            return [[0.0] * 768 for _ in texts]  # Fallback to zero embeddings
+            logger.warning("Embedding error: %s", e)
+            return [[0.0] * EMBEDDING_DIM for _ in texts]  # Fallback to zero embeddings
     
     def get_query_embedding(self, query: str) -> List[float]:
         """Get embedding for a search query."""
+        cache_key = query_hash(query)
+        cached = query_embedding_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
         try:
-            input_obj = TextEmbeddingInput(query, "RETRIEVAL_QUERY")
-            embedding = self.model.get_embeddings([input_obj])
-            return embedding[0].values
+            embedding = query_embedding_batcher.call(query)
+            query_embedding_cache.set(cache_key, tuple(embedding))
+            return embedding
         except Exception as e:
-            print(f"Query embedding error: {e}")
-            return [0.0] * 768
+            logger.warning("Query embedding error: %s", e)
+            return [0.0] * EMBEDDING_DIM
 
 embedding_service = EmbeddingService()
 
 class RegulatoryRAG:
     """RAG system for regulatory queries."""
     
-    def __init__(self):
-        self.bq = bq_client
+    @property
+    def bq(self):
+        return bq_client
         
-    def search_regulations_semantic(self, query: str, date: str, limit: int = 10, conversation_history: List[Dict[str, str]] = None) -> List[RegulationContext]:
-        """Search regulations using semantic similarity."""
+    def search_regulations_semantic(self, query: str, date: date_type, limit: int = 10, conversation_history: List[Dict[str, str]] = None) -> List[RegulationContext]:
+        """Search regulations using semantic similarity.
         
-        # For now, use keyword-based search as fallback
-        # In production, you'd want to implement vector similarity search
-        return self.search_regulations_keyword(query, date, limit, conversation_history)
+        Citations and follow-ups go to the keyword path, which resolves them
+        exactly; so does anything the vector search cannot answer.
+        """
+        query_lower = query.lower()
+        if (not VECTOR_SEARCH_ENABLED or _CFR_QUERY_RE.search(query_lower)
+                or (conversation_history and self.detect_followup_question_simple(query_lower))):
+            return self.search_regulations_keyword(query, date, limit, conversation_history)
+        
+        if not has_searchable_terms(query_lower):
+            raise InsufficientQueryError(query)
+        
+        cache_key = ("vector", normalize_query(query_lower), date, limit)
+        cached = search_cache.get(cache_key)
+        if cached is None:
+            cached = tuple(self.search_regulations_vector(query, date, limit))
+            if not cached:
+                return self.search_regulations_keyword(query, date, limit, conversation_history)
+            search_cache.set(cache_key, cached)
+        return list(cached)
+    
+    def search_regulations_vector(self, query: str, date: date_type, limit: int = 10) -> List[RegulationContext]:
+        """Top sections by cosine similarity to the query embedding; empty if unavailable."""
+        embedding = embedding_service.get_query_embedding(query)
+        if not any(embedding):
+            return []  # Embedding call failed and returned the zero vector
+        params = [
+            bigquery.ScalarQueryParameter("date", "DATE", date),
+            bigquery.ArrayQueryParameter("embedding", "FLOAT64", list(embedding)),
+            bigquery.ScalarQueryParameter("limit", "INT64", limit)
+        ]
+        sql = VECTOR_SEARCH_SQL
+        if VECTOR_SEARCH_QUANTIZED:
+            sql = QUANTIZED_VECTOR_SEARCH_SQL
+            params += [
+                bigquery.ScalarQueryParameter("bits", "BYTES", pack_embedding_bits(embedding)),
+                bigquery.ScalarQueryParameter("candidates", "INT64", max(QUANTIZED_CANDIDATES, limit))
+            ]
+        try:
+            rows = self.bq.query_and_wait(sql, job_config=chat_query_config(params))
+        except (BadRequest, Forbidden, TooManyRequests) as e:
+            logger.warning("VECTOR_SEARCH failed, falling back to keyword search (%s): %s", type(e).__name__, e)
+            return []
+        return [RegulationContext.from_bq_row(row) for row in rows]
     
-    def search_regulations_keyword(self, query: str, date: str, limit: int = 10, conversation_history: List[Dict[str, str]] = None) -> List[RegulationContext]:
+    def search_regulations_keyword(self, query: str, date: date_type, limit: int = 10, conversation_history: List[Dict[str, str]] = None) -> List[RegulationContext]:
         """Search regulations using advanced keyword matching and semantic concepts."""
         
+        query_lower = query.lower()
+        
         # Check if this is a follow-up question
-        is_followup = self.detect_followup_question_simple(query)
+        is_followup = self.detect_followup_question_simple(query_lower)
         previous_citations = self.extract_previous_citations(conversation_history) if conversation_history else []
         
-        print(f"Search - Query: {query}, Is followup: {is_followup}, Previous citations: {previous_citations}")
+        logger.debug("Search - Query: %s, Is followup: %s, Previous citations: %s", query, is_followup, previous_citations)
         
         # For follow-up questions, search specifically for the previously mentioned sections
         if is_followup and previous_citations:
-            return self.search_specific_citations(previous_citations, date)
+            return self.search_previous_citations(previous_citations[0], date)
         
-        # Otherwise, use the original search method
-        return self.search_regulations_keyword_original(query, date, limit)
+        # Otherwise, use the original search method (cached per normalized question)
+        normalized = normalize_query(query_lower)
+        cache_key = (normalized, date, limit)
+        cached = search_cache.get(cache_key)
+        if cached is None:
+            cached = tuple(self.search_regulations_keyword_original(normalized, date, limit))
+            search_cache.set(cache_key, cached)
+        return list(cached)
     
-    def detect_followup_question_simple(self, query: str) -> bool:
+    def detect_followup_question_simple(self, query_lower: str) -> bool:
         """Simple follow-up detection for search purposes."""
-        query_lower = query.lower()
-        return any(indicator in query_lower for indicator in [
-            'tell me more', 'more about', 'it', 'that', 'this', 'details', 'summary', 'elaborate'
-        ])
+        return _SEARCH_FOLLOWUP_RE.search(query_lower) is not None
+    
+    def search_previous_citations(self, citation: str, date: date_type) -> List[RegulationContext]:
+        """Fetch the section cited in the previous answer."""
+        # extract_previous_citations matched "<title> CFR § <part>.<section>"
+        title, section = citation.split()[0], citation.split('§')[1].strip()
+        rows = self.bq.query_and_wait(PREVIOUS_CITATION_SQL, job_config=chat_query_config([
+            bigquery.ScalarQueryParameter("date", "DATE", date),
+            bigquery.ScalarQueryParameter("title", "INT64", int(title)),
+            bigquery.ScalarQueryParameter("part", "STRING", section.split('.')[0]),
+            bigquery.ScalarQueryParameter("citation", "STRING", citation)
+        ]))
+        
+        # High relevance for exact matches
+        return [RegulationContext.from_bq_row(row, relevance_score=100.0) for row in rows]
     
-    def search_specific_citations(self, citations: List[str], date: str) -> List[RegulationContext]:
-        """Search for specific CFR citations."""
-        results = []
-        for citation in citations:
-            # Parse citation to extract title and part
-            match = re.search(r'(\d+)\s+CFR\s+§\s+([\d.]+)', citation)
-            if match:
-                title_num = int(match.group(1))
-                section_parts = match.group(2).split('.')
-                
-                sql = f"""
-                SELECT 
-                    section_citation, title_num, part_num, agency_name, section_heading, 
-                    section_text, regulatory_burden_score, prohibition_count, requirement_count,
-                    enforcement_terms, ai_context_summary, word_count
-                FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-                WHERE version_date = DATE(@date) 
-                  AND title_num = @title
-                  AND section_citation = @citation
-                LIMIT 1
-                """
-                
-                job = self.bq.query(sql, job_config=bigquery.QueryJobConfig(
-                    query_parameters=[
-                        bigquery.ScalarQueryParameter("date", "STRING", date),
-                        bigquery.ScalarQueryParameter("title", "INT64", title_num),
-                        bigquery.ScalarQueryParameter("citation", "STRING", citation)
-                    ]
-                ))
-                
-                for row in job.result():
-                    context = RegulationContext(
-                        section_citation=row.section_citation or "",
-                        title_num=row.title_num or 0,
-                        part_num=row.part_num or "",
-                        agency_name=row.agency_name or "Unknown",
-                        section_heading=row.section_heading or "",
-                        section_text=row.section_text or "",
-                        regulatory_burden_score=row.regulatory_burden_score or 0.0,
-                        prohibition_count=row.prohibition_count or 0,
-                        requirement_count=row.requirement_count or 0,
-                        enforcement_terms=row.enforcement_terms or 0,
-                        ai_context_summary=row.ai_context_summary or "",
-                        relevance_score=100.0  # High relevance for exact matches
-                    )
-                    results.append(context)
-        
-        return results
-    
-    def search_regulations_keyword_original(self, query: str, date: str, limit: int = 10, conversation_history: List[Dict[str, str]] = None) -> List[RegulationContext]:
-        """Original keyword search method (renamed to avoid conflicts)."""
+    def search_regulations_keyword_original(self, query_lower: str, date: date_type, limit: int = 10, conversation_history: List[Dict[str, str]] = None) -> List[RegulationContext]:
+        """Original keyword search method (renamed to avoid conflicts); expects a lowercased query."""
         
         # Extract key terms from the query
-        query_lower = query.lower()
         search_terms = []
         
-        # Enhanced regulatory concept detection
-        regulatory_concepts = {
-            'compliance': ['compliance', 'conform', 'adhere', 'meet', 'satisfy'],
-            'safety': ['safety', 'hazard', 'danger', 'risk', 'secure', 'protection'],
-            'environment': ['environment', 'pollution', 'emission', 'waste', 'air', 'water', 'soil', 'contamination'],
-            'enforcement': ['penalty', 'fine', 'violation', 'enforce', 'sanction', 'punishment', 'citation'],
-            'requirement': ['requirement', 'must', 'shall', 'required', 'mandatory', 'obligation'],
-            'prohibition': ['prohibition', 'prohibited', 'forbidden', 'banned', 'not permitted', 'shall not'],
-            'disclosure': ['disclosure', 'report', 'notify', 'inform', 'submit', 'file'],
-            'ethical': ['ethical', 'ethics', 'conduct', 'conflict', 'integrity', 'standards'],
-            'financial': ['financial', 'cost', 'fee', 'payment', 'dollar', 'money', 'budget'],
-            'management': ['management', 'administration', 'oversight', 'supervision', 'control'],
-            'security': ['security', 'classified', 'confidential', 'access', 'clearance'],
-            'training': ['training', 'education', 'instruction', 'course', 'program']
-        }
-        
         # Find matching concepts
-        detected_concepts = []
-        for concept, terms in regulatory_concepts.items():
-            if any(term in query_lower for term in terms):
-                detected_concepts.append(concept)
-                search_terms.extend(terms[:2])  # Add top 2 terms for each concept
+        detected_concepts = detect_concepts(query_lower)
+        for concept in detected_concepts:
+            search_terms.extend(_CONCEPT_TOP_TERMS[concept])  # Add top terms for each concept
         
         # Extract CFR citations if present
-        cfr_pattern = r'(?:title\s+)?(\d+)\s+cfr\s+(?:part\s+)?(\d+)(?:\.(\d+))?'
-        cfr_matches = re.findall(cfr_pattern, query_lower)
+        cfr_matches = _CFR_QUERY_RE.findall(query_lower)
         
-        # Build search query
-        where_conditions = ["version_date = DATE(@date)"]
-        params = [bigquery.ScalarQueryParameter("date", "STRING", date)]
+        # Bind parameters for the query shape; the SQL text itself comes from _SQL_TEMPLATES
+        params = [bigquery.ScalarQueryParameter("date", "DATE", date)]
+        text_terms = {}  # parameter name -> raw term, bound per search mode below
+        num_concepts = num_words = 0
+        has_section = False
         
         if cfr_matches:
             # Specific CFR citation search
             title_num, part_num, section_num = cfr_matches[0]
-            where_conditions.append("title_num = @title")
-            where_conditions.append("part_num = @part")
             params.extend([
                 bigquery.ScalarQueryParameter("title", "INT64", int(title_num)),
                 bigquery.ScalarQueryParameter("part", "STRING", part_num)
             ])
             if section_num:
-                where_conditions.append("section_citation LIKE @section")
-                params.append(bigquery.ScalarQueryParameter("section", "STRING", f"%{section_num}%"))
+                has_section = True
+                params.append(bigquery.ScalarQueryParameter("section", "STRING", f"{part_num}.{section_num}"))
         else:
             # Enhanced keyword-based search with concept detection
-            search_conditions = []
-            
-            # If we detected concepts, search for them
-            if detected_concepts:
-                for i, concept in enumerate(detected_concepts[:3]):
-                    concept_terms = regulatory_concepts[concept][:2]  # Top 2 terms per concept
-                    concept_condition = []
-                    for j, term in enumerate(concept_terms):
-                        param_name = f"concept{i}_{j}"
-                        concept_condition.append(f"(LOWER(section_text) LIKE @{param_name} OR LOWER(section_heading) LIKE @{param_name})")
-                        params.append(bigquery.ScalarQueryParameter(param_name, "STRING", f"%{term}%"))
-                    search_conditions.append(f"({' OR '.join(concept_condition)})")
+            concepts = detected_concepts[:MAX_CONCEPT_GROUPS]
+            for i, concept in enumerate(concepts):
+                for j, term in enumerate(_CONCEPT_TOP_TERMS[concept]):
+                    text_terms[f"concept{i}_{j}"] = term
+            num_concepts = len(concepts)
             
             # Always include direct query terms
-            query_words = [word.strip() for word in query_lower.split() if len(word.strip()) > 2][:5]  # Max 5 words
+            query_words = [word.strip() for word in query_lower.split() if len(word.strip()) > 2][:MAX_QUERY_WORDS]
             for i, word in enumerate(query_words):
-                param_name = f"word{i}"
-                search_conditions.append(f"(LOWER(section_text) LIKE @{param_name} OR LOWER(section_heading) LIKE @{param_name})")
-                params.append(bigquery.ScalarQueryParameter(param_name, "STRING", f"%{word}%"))
+                text_terms[f"word{i}"] = word
+            num_words = len(query_words)
             
-            if search_conditions:
-                where_conditions.append(f"({' OR '.join(search_conditions)})")
-            else:
+            if not concepts and not query_words:
+                if len(query_lower.split()) < MIN_UNTERMED_QUERY_WORDS:
+                    raise InsufficientQueryError(query_lower)
                 # Ultimate fallback: search entire query
-                where_conditions.append("(LOWER(section_text) LIKE @query OR LOWER(section_heading) LIKE @query)")
-                params.append(bigquery.ScalarQueryParameter("query", "STRING", f"%{query_lower}%"))
-        
-        sql = f"""
-        SELECT 
-            section_citation,
-            title_num,
-            part_num,
-            agency_name,
-            section_heading,
-            section_text,
-            regulatory_burden_score,
-            prohibition_count,
-            requirement_count,
-            enforcement_terms,
-            ai_context_summary,
-            word_count,
-            -- Enhanced relevance scoring with multiple factors
-            (
-                CASE WHEN LOWER(section_heading) LIKE @query_param THEN 15 ELSE 0 END +
-                CASE WHEN LOWER(section_text) LIKE @query_param THEN 10 ELSE 0 END +
-                CASE WHEN regulatory_burden_score > 50 THEN 5 ELSE 0 END +
-                CASE WHEN prohibition_count > 0 THEN 3 ELSE 0 END +
-                CASE WHEN requirement_count > 2 THEN 2 ELSE 0 END +
-                CASE WHEN enforcement_terms > 0 THEN 4 ELSE 0 END +
-                CASE WHEN word_count > 100 THEN 2 ELSE 1 END
-            ) as relevance_score
-        FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-        WHERE {' AND '.join(where_conditions)}
-        ORDER BY relevance_score DESC, regulatory_burden_score DESC
-        LIMIT @limit
-        """
+                text_terms["query"] = query_lower
         
         params.extend([
-            bigquery.ScalarQueryParameter("query_param", "STRING", f"%{query_lower}%"),
+            bigquery.ScalarQueryParameter("query_text", "STRING", query_lower),
+            bigquery.ScalarQueryParameter("query_norm", "STRING", normalize_heading(query_lower)),
             bigquery.ScalarQueryParameter("limit", "INT64", limit)
         ])
         
-        job = self.bq.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
-        results = []
-        
-        for row in job.result():
-            context = RegulationContext(
-                section_citation=row.section_citation or "",
-                title_num=row.title_num or 0,
-                part_num=row.part_num or "",
-                agency_name=row.agency_name or "Unknown",
-                section_heading=row.section_heading or "",
-                section_text=row.section_text or "",
-                regulatory_burden_score=row.regulatory_burden_score or 0.0,
-                prohibition_count=row.prohibition_count or 0,
-                requirement_count=row.requirement_count or 0,
-                enforcement_terms=row.enforcement_terms or 0,
-                ai_context_summary=row.ai_context_summary or "",
-                relevance_score=row.relevance_score or 0.0
-            )
-            results.append(context)
-        
-        return results
+        # Concurrent searches are coalesced into one BigQuery job
+        shape = (num_concepts, num_words, bool(cfr_matches), has_section)
+        rows = search_batcher.search(shape, params, text_terms)
+        return [RegulationContext.from_bq_row(row) for row in rows]
+    
+    def response_cache_key(self, query: str, date: date_type, context_sections: List[RegulationContext]):
+        """The Gemini answer depends only on the question and the sections packed into the prompt."""
+        return (query_hash(query), date, tuple(section.section_citation for section in context_sections))
     
-    def generate_response(self, query: str, context_sections: List[RegulationContext], conversation_history: List[Dict[str, str]]) -> str:
-        """Generate AI response using retrieved context."""
+    async def generate_response(self, query: str, context_sections: List[RegulationContext], conversation_history: List[Dict[str, str]], date: date_type = None) -> Tuple[str, Optional[str]]:
+        """Generate AI response using retrieved context.
+        
+        Returns the answer and the model tier that wrote it, or None when it
+        came from the response cache or the template fallback.
+        """
         
         # Fallback intelligent response system when Vertex AI is unavailable
         if not context_sections:
-            return "I couldn't find any specific regulations related to your question. Could you please provide more details or try rephrasing your question? For example, you could mention specific CFR titles, parts, or regulatory topics."
+            return "I couldn't find any specific regulations related to your question. Could you please provide more details or try rephrasing your question? For example, you could mention specific CFR titles, parts, or regulatory topics.", None
+        
+        cache_key = self.response_cache_key(query, date, context_sections)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached, None
         
         try:
             # Generate response using Gemini
-            print(f"Attempting Vertex AI generation with {len(context_sections)} context sections...")
+            logger.debug("Attempting Vertex AI generation with %d context sections...", len(context_sections))
             
-            # Build system prompt
-            system_prompt = """You are an expert regulatory analyst specializing in the Code of Federal Regulations (CFR). Provide comprehensive analysis with specific citations, burden scores, and practical compliance guidance."""
-
-            # Build context from retrieved sections
-            context_text = "\n\n".join([
-                f"**{section.section_citation}** (Burden Score: {section.regulatory_burden_score:.1f}/100)\n"
-                f"Agency: {section.agency_name}\n"
-                f"Heading: {section.section_heading}\n"
-                f"Key Metrics: {section.prohibition_count} prohibitions, {section.requirement_count} requirements, {section.enforcement_terms} enforcement terms\n"
-                f"Text: {section.section_text[:800]}{'...' if len(section.section_text) > 800 else ''}"
-                for section in context_sections[:3]
-            ])
+            prompt, prompt_tokens = self.build_prompt(query, context_sections)
+            tier = self.model_tier(prompt_tokens, context_sections)
+            response = await self.model_for_tier(tier).generate_content_async(prompt)
+            logger.debug("Vertex AI generation successful")
+            # Only model answers are cached; the template fallback is cheap and may depend on history
+            response_cache.set(cache_key, response.text)
+            return response.text, tier
             
-            full_prompt = f"{system_prompt}\n\nREGULATORY CONTEXT:\n{context_text}\n\nUSER QUESTION: {query}\n\nProvide a comprehensive answer with specific citations and burden analysis."
+        except Exception as e:
+            logger.warning("Vertex AI generation failed (%s): %s", type(e).__name__, e)
+            # Fallback to intelligent template-based response
+            return await asyncio.to_thread(self.generate_intelligent_fallback_response, query, context_sections, conversation_history), None
+    
+    async def stream_response(self, query: str, context_sections: List[RegulationContext], conversation_history: List[Dict[str, str]], date: date_type = None, generation: Dict[str, Any] = None) -> AsyncIterator[str]:
+        """Stream the AI response as text chunks; falls back like generate_response if nothing was generated.
+        
+        When a model writes the answer its tier is stored in generation["model_tier"].
+        """
+        cache_key = self.response_cache_key(query, date, context_sections)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+        
+        streamed = []
+        try:
+            logger.debug("Attempting Vertex AI streaming with %d context sections...", len(context_sections))
             
-            response = generative_model.generate_content(full_prompt)
-            print(f"Vertex AI generation successful")
-            return response.text
+            prompt, prompt_tokens = self.build_prompt(query, context_sections)
+            tier = self.model_tier(prompt_tokens, context_sections)
+            response = await self.model_for_tier(tier).generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                streamed.append(chunk.text)
+                yield chunk.text
+            response_cache.set(cache_key, "".join(streamed))
+            if generation is not None:
+                generation["model_tier"] = tier
             
         except Exception as e:
-            print(f"Vertex AI generation failed ({type(e).__name__}): {e}")
-            # Fallback to intelligent template-based response
-            return self.generate_intelligent_fallback_response(query, context_sections, conversation_history)
+            logger.warning("Vertex AI streaming failed (%s): %s", type(e).__name__, e)
+            if streamed:
+                raise
+            # Nothing reached the client yet, so the template answer can stand in whole
+            yield await asyncio.to_thread(self.generate_intelligent_fallback_response, query, context_sections, conversation_history)
+    
+    def model_tier(self, prompt_tokens: int, context_sections: List[RegulationContext]) -> str:
+        """'pro' for a long prompt or high-burden context, otherwise 'flash'."""
+        if prompt_tokens > PRO_PROMPT_TOKENS or any(s.regulatory_burden_score > PRO_BURDEN_SCORE for s in context_sections):
+            return "pro"
+        return "flash"
+    
+    def model_for_tier(self, tier: str) -> GenerativeModel:
+        return generative_model if tier == "pro" else fast_generative_model
+    
+    def build_prompt(self, query: str, context_sections: List[RegulationContext]) -> Tuple[str, int]:
+        """Fill the RAG prompt with as many retrieved sections as fit in MAX_CONTEXT_TOKENS;
+        returns the prompt and its token count.
+        
+        Sections are packed greedily by relevance, then burden score; one that
+        doesn't fit is skipped so a shorter one after it can still be used.
+        """
+        budget = MAX_CONTEXT_TOKENS - count_tokens(RAG_PROMPT_TEMPLATE.format_map({"context": "", "query": query}))
+        prompt_tokens = MAX_CONTEXT_TOKENS - budget
+        parts = []
+        for section in sorted(context_sections, key=lambda s: (s.relevance_score, s.regulatory_burden_score), reverse=True):
+            text = section.section_text
+            # section_text is the ingest-time preview; at full length it was cut
+            marker = '...' if len(text) >= SECTION_PREVIEW_CHARS else ''
+            block = (
+                f"**{section.section_citation}** (Burden Score: {section.regulatory_burden_score:.1f}/100)\n"
+                f"Agency: {section.agency_name}\n"
+                f"Heading: {section.section_heading}\n"
+                f"Key Metrics: {section.prohibition_count} prohibitions, {section.requirement_count} requirements, {section.enforcement_terms} enforcement terms\n"
+                f"Text: {text}{marker}"
+            )
+            tokens = count_tokens(block)
+            if tokens > budget:
+                continue
+            parts.append(block)
+            budget -= tokens
+            prompt_tokens += tokens
+        context_text = "\n\n".join(parts)
+        
+        logger.debug("Prompt: %d/%d sections, ~%d tokens", len(parts), len(context_sections), prompt_tokens)
+        return RAG_PROMPT_TEMPLATE.format_map({"context": context_text, "query": query}), prompt_tokens
     
     def generate_intelligent_fallback_response(self, query: str, context_sections: List[RegulationContext], conversation_history: List[Dict[str, str]] = None) -> str:
         """Generate intelligent responses without external AI using templates and analysis."""
@@ -365,13 +947,14 @@ class RegulatoryRAG:
         query_lower = query.lower()
         
         # Check if this is a follow-up question by analyzing conversation history
-        is_followup = self.detect_followup_question(query, conversation_history)
+        is_followup = self.detect_followup_question(query_lower, conversation_history)
         previous_citations = self.extract_previous_citations(conversation_history) if conversation_history else []
         
-        print(f"Query: {query}")
-        print(f"Is followup: {is_followup}")
-        print(f"Previous citations: {previous_citations}")
-        print(f"Available sections: {[s.section_citation for s in context_sections]}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Query: %s", query)
+            logger.debug("Is followup: %s", is_followup)
+            logger.debug("Previous citations: %s", previous_citations)
+            logger.debug("Available sections: %s", [s.section_citation for s in context_sections])
         
         # Sort sections by relevance and burden score
         sorted_sections = sorted(context_sections, key=lambda x: (x.relevance_score, x.regulatory_burden_score), reverse=True)
@@ -380,7 +963,8 @@ class RegulatoryRAG:
         if is_followup and previous_citations:
             # Filter to sections matching previous citations first
             matching_sections = [s for s in sorted_sections if s.section_citation in previous_citations]
-            print(f"Matching sections for followup: {[s.section_citation for s in matching_sections]}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Matching sections for followup: %s", [s.section_citation for s in matching_sections])
             if matching_sections:
                 sorted_sections = matching_sections + [s for s in sorted_sections if s.section_citation not in previous_citations]
         
@@ -390,26 +974,19 @@ class RegulatoryRAG:
             return "I couldn't find any specific regulations related to your question."
         
         # Handle different types of queries
-        if self.is_summary_request(query):
+        if self.is_summary_request(query_lower):
             return self.generate_summary_response(top_section, query, is_followup)
-        elif self.is_detail_request(query):
+        elif self.is_detail_request(query_lower):
             return self.generate_detailed_response(top_section, query, is_followup)
         else:
-            return self.generate_standard_response(query, sorted_sections, is_followup)
+            return self.generate_standard_response(query_lower, sorted_sections, is_followup)
     
-    def detect_followup_question(self, query: str, conversation_history: List[Dict[str, str]]) -> bool:
+    def detect_followup_question(self, query_lower: str, conversation_history: List[Dict[str, str]]) -> bool:
         """Detect if this is a follow-up question to a previous query."""
         if not conversation_history:
             return False
         
-        query_lower = query.lower()
-        followup_indicators = [
-            'tell me more', 'more about', 'explain that', 'what about', 'how about',
-            'details', 'summary', 'elaborate', 'clarify', 'it', 'that', 'this',
-            'what does it', 'how does it', 'why does it', 'when does it'
-        ]
-        
-        return any(indicator in query_lower for indicator in followup_indicators)
+        return _FOLLOWUP_RE.search(query_lower) is not None
     
     def extract_previous_citations(self, conversation_history: List[Dict[str, str]]) -> List[str]:
         """Extract CFR citations from previous conversation."""
@@ -420,27 +997,22 @@ class RegulatoryRAG:
         # Look at the last assistant response
         last_response = conversation_history[-1].get('assistant', '') if conversation_history else ''
         
-        # Look for the first/primary citation mentioned (usually the main topic)
-        cfr_pattern = r'(\d+\s+CFR\s+§\s+[\d.]+[A-Za-z]*(?:-[\d.]+[A-Za-z]*)?)'
-        matches = re.findall(cfr_pattern, last_response)
-        
-        if matches:
-            # Take the first citation as the primary one
-            citations.append(matches[0])
+        # Look for the first/primary citation mentioned (usually the main topic);
+        # stop at the first hit rather than scanning the whole response
+        match = _CFR_PREV_RE.search(last_response)
+
+        if match:
+            citations.append(match.group(1))
         
         return citations
     
-    def is_summary_request(self, query: str) -> bool:
+    def is_summary_request(self, query_lower: str) -> bool:
         """Check if user is asking for a summary."""
-        query_lower = query.lower()
-        summary_keywords = ['summary', 'summarize', 'simple', 'brief', 'short', 'one line', 'tldr', 'essence', 'gist']
-        return any(keyword in query_lower for keyword in summary_keywords)
+        return _SUMMARY_RE.search(query_lower) is not None
     
-    def is_detail_request(self, query: str) -> bool:
+    def is_detail_request(self, query_lower: str) -> bool:
         """Check if user is asking for more details."""
-        query_lower = query.lower()
-        detail_keywords = ['more', 'detail', 'elaborate', 'explain', 'tell me about', 'describe', 'how', 'why', 'what']
-        return any(keyword in query_lower for keyword in detail_keywords)
+        return _DETAIL_RE.search(query_lower) is not None
     
     def generate_summary_response(self, section: RegulationContext, query: str, is_followup: bool) -> str:
         """Generate a concise summary response."""
@@ -504,7 +1076,7 @@ class RegulatoryRAG:
         
         return "\n\n".join(response_parts)
     
-    def generate_standard_response(self, query: str, sorted_sections: List[RegulationContext], is_followup: bool) -> str:
+    def generate_standard_response(self, query_lower: str, sorted_sections: List[RegulationContext], is_followup: bool) -> str:
         """Generate a standard response for general queries."""
         top_section = sorted_sections[0]
         burden_level = self.get_burden_level(top_section.regulatory_burden_score)
@@ -533,12 +1105,11 @@ class RegulatoryRAG:
             response_parts.append(f"**Key Components:** {', '.join(metrics)}")
         
         # Context-aware analysis
-        query_lower = query.lower()
-        if any(term in query_lower for term in ['requirement', 'must', 'shall', 'required']):
+        if _REQUIREMENT_RE.search(query_lower):
             if top_section.requirement_count > 0:
                 response_parts.append(f"This regulation contains **{top_section.requirement_count} specific requirements** for compliance.")
         
-        if any(term in query_lower for term in ['penalty', 'fine', 'violation', 'enforcement']):
+        if _ENFORCEMENT_RE.search(query_lower):
             if top_section.enforcement_terms > 0:
                 response_parts.append(f"**Enforcement:** Contains **{top_section.enforcement_terms} enforcement mechanisms** with potential penalties.")
         
@@ -552,24 +1123,87 @@ class RegulatoryRAG:
     
     def get_burden_level(self, score: float) -> str:
         """Determine regulatory burden level."""
-        if score <= 25: return "Low Risk"
-        elif score <= 50: return "Moderate Risk"
-        elif score <= 75: return "High Risk"
-        else: return "Critical Risk"
+        return BURDEN_LEVELS[bisect.bisect_left(BURDEN_THRESHOLDS, score)]
 
 rag_service = RegulatoryRAG()
 
+@app.on_event("startup")
+async def configure_threadpool():
+    """Size the per-process thread pools that run blocking BigQuery/Vertex calls."""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=THREADPOOL_SIZE))
+
+async def init_clients_with_retry():
+    """Initialize clients off the event loop, backing off between failed attempts."""
+    for attempt in range(1, INIT_MAX_ATTEMPTS + 1):
+        try:
+            await asyncio.to_thread(init_clients)
+            logger.info("Vertex AI and BigQuery clients initialized")
+            return
+        except Exception as e:
+            logger.warning("Client initialization failed (attempt %d/%d): %s", attempt, INIT_MAX_ATTEMPTS, e)
+            if attempt < INIT_MAX_ATTEMPTS:
+                await asyncio.sleep(min(2 ** attempt, 30))
+
+@app.on_event("startup")
+async def start_batchers():
+    search_batcher.start()
+    query_embedding_batcher.start()
+
+@app.on_event("startup")
+async def start_client_init():
+    """Start client initialization in the background; /health reports readiness."""
+    app.state.client_init = asyncio.create_task(init_clients_with_retry())
+
 @app.get("/")
 def root():
     return {"message": "eCFR AI Assistant API", "status": "ready"}
 
+NO_CONTEXT_RESPONSE = "I couldn't find any specific regulations related to your question. Could you please provide more details or try rephrasing your question? For example, you could mention specific CFR titles, parts, or regulatory topics like 'safety requirements' or 'environmental compliance'."
+QUERY_SUGGESTIONS = (
+    "What are the safety requirements for commercial vehicles?",
+    "What does 40 CFR 60.1 cover?",
+    "Which environmental reporting obligations apply to manufacturers?",
+    "What penalties apply for violating FDA labeling rules?",
+)
+
+def build_sources(context_sections: List[RegulationContext]):
+    """Prepare sources and context labels for the frontend."""
+    sources = []
+    context_used = []
+    
+    for section in context_sections:
+        source = {
+            "citation": section.section_citation,
+            "title": section.title_num,
+            "part": section.part_num,
+            "agency": section.agency_name,
+            "heading": section.section_heading,
+            "burden_score": section.regulatory_burden_score,
+            "relevance": section.relevance_score,
+            "summary": section.ai_context_summary[:200] + "..." if len(section.ai_context_summary) > 200 else section.ai_context_summary
+        }
+        sources.append(source)
+        context_used.append(f"{section.section_citation}: {section.section_heading}")
+    
+    return sources, context_used
+
+def sse_event(data: Dict[str, Any], event: str = None) -> str:
+    """Format one server-sent event."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {dumps_json(data)}\n\n"
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Main chat endpoint for regulatory AI assistant."""
     
+    if not clients_ready():
+        raise HTTPException(status_code=503, detail="AI service is still initializing")
+    
     try:
-        # Search for relevant regulations
-        context_sections = rag_service.search_regulations_semantic(
+        # Search for relevant regulations (BigQuery client is blocking, so run it off the event loop)
+        context_sections = await asyncio.to_thread(
+            rag_service.search_regulations_semantic,
             request.message, 
             request.date, 
             limit=request.max_context_sections,
@@ -579,58 +1213,126 @@ async def chat(request: ChatRequest):
         if not context_sections:
             # No relevant context found
             return ChatResponse(
-                response="I couldn't find any specific regulations related to your question. Could you please provide more details or try rephrasing your question? For example, you could mention specific CFR titles, parts, or regulatory topics like 'safety requirements' or 'environmental compliance'.",
+                response=NO_CONTEXT_RESPONSE,
                 sources=[],
                 context_used=[]
             )
         
         # Generate AI response
-        ai_response = rag_service.generate_response(
+        ai_response, model_tier = await rag_service.generate_response(
             request.message,
             context_sections,
-            request.conversation_history
+            request.conversation_history,
+            date=request.date
         )
         
-        # Prepare sources for frontend
-        sources = []
-        context_used = []
-        
-        for section in context_sections:
-            source = {
-                "citation": section.section_citation,
-                "title": section.title_num,
-                "part": section.part_num,
-                "agency": section.agency_name,
-                "heading": section.section_heading,
-                "burden_score": section.regulatory_burden_score,
-                "relevance": section.relevance_score,
-                "summary": section.ai_context_summary[:200] + "..." if len(section.ai_context_summary) > 200 else section.ai_context_summary
-            }
-            sources.append(source)
-            context_used.append(f"{section.section_citation}: {section.section_heading}")
+        sources, context_used = build_sources(context_sections)
         
         return ChatResponse(
             response=ai_response,
             sources=sources,
-            context_used=context_used
+            context_used=context_used,
+            model_tier=model_tier
         )
         
+    except InsufficientQueryError:
+        return ChatResponse(
+            response=NO_CONTEXT_RESPONSE,
+            sources=[],
+            context_used=[],
+            suggestions=list(QUERY_SUGGESTIONS)
+        )
     except Exception as e:
-        print(f"Chat error: {e}")
+        logger.error("Chat error: %s", e)
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """Streaming variant of /chat as server-sent events.
+    
+    Emits one `sources` event, then `data` events carrying {"text": ...} chunks,
+    then a `done` event carrying the model_tier that wrote the answer (null for
+    cached or template answers), or an `error` event if generation fails midway.
+    """
+    
+    if not clients_ready():
+        raise HTTPException(status_code=503, detail="AI service is still initializing")
+    
+    suggestions = []
+    try:
+        context_sections = await asyncio.to_thread(
+            rag_service.search_regulations_semantic,
+            request.message, 
+            request.date, 
+            limit=request.max_context_sections,
+            conversation_history=request.conversation_history
+        )
+    except InsufficientQueryError:
+        context_sections, suggestions = [], list(QUERY_SUGGESTIONS)
+    except Exception as e:
+        logger.error("Chat stream error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+    
+    async def event_generator():
+        sources, context_used = build_sources(context_sections)
+        generation = {}
+        # Citations go first so the frontend can render them while the answer generates
+        yield sse_event({"sources": sources, "context_used": context_used, "suggestions": suggestions}, event="sources")
+        
+        try:
+            if not context_sections:
+                yield sse_event({"text": NO_CONTEXT_RESPONSE})
+            else:
+                async for text in rag_service.stream_response(request.message, context_sections, request.conversation_history, date=request.date, generation=generation):
+                    yield sse_event({"text": text})
+            yield sse_event({"model_tier": generation.get("model_tier")}, event="done")
+        except Exception as e:
+            logger.error("Chat stream error: %s", e)
+            yield sse_event({"detail": f"Error processing request: {str(e)}"}, event="error")
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/health")
 def health():
     """Health check endpoint."""
-    return {
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
-        "services": {
-            "vertex_ai": "connected",
-            "bigquery": "connected"
+    ready = clients_ready()
+    service_status = "connected" if ready else "unavailable"
+    return DefaultJSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "healthy" if ready else "initializing",
+            "timestamp": datetime.now().isoformat(),
+            "services": {
+                "vertex_ai": service_status,
+                "bigquery": service_status
+            },
+            "caches": {
+                "search": search_cache.stats(),
+                "query_embedding": query_embedding_cache.stats(),
+                "response": response_cache.stats()
+            }
         }
-    }
+    )
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+
+    # uvloop/httptools ship with uvicorn[standard] on Linux; fall back to the
+    # pure-Python implementations where the wheels aren't available.
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "h11"
+
+    # Workers are separate processes, each with its own clients and thread pool
+    uvicorn.run("main:app", host="0.0.0.0", port=8001, loop=loop, http=http, workers=WEB_CONCURRENCY)
\ No newline at end of file
@@ -1,31 +1,222 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from typing import Optional, List
 import os
+import json
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
 from dotenv import load_dotenv
 from datetime import datetime, date, timedelta
 
 # BigQuery client
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
+from requests.adapters import HTTPAdapter
+
+# Large results are read over the BigQuery Storage Read API (both packages are
+# pinned in pyproject.toml); an install without them pages through REST instead
+try:
+    from google.cloud import bigquery_storage
+    import pyarrow  # noqa: F401 - required by RowIterator.to_arrow
+except ImportError:
+    bigquery_storage = None
 
 load_dotenv()
 
 PROJECT_ID = os.getenv("PROJECT_ID")
 DATASET = os.getenv("DATASET", "ecfr")
 TABLE   = os.getenv("TABLE", "sections")
+AGENCY_WORDCOUNT_VIEW = os.getenv("AGENCY_WORDCOUNT_VIEW", "mv_agency_wordcount_daily")
+PART_HASH_TABLE = os.getenv("PART_HASH_TABLE", "part_hashes")
+AGENCY_METRICS_TABLE = os.getenv("AGENCY_METRICS_TABLE", "agency_metrics_daily")
+BQ_POOL_SIZE = int(os.getenv("BQ_POOL_SIZE", "40"))  # Starlette's default worker thread count
+STORAGE_API_MIN_ROWS = int(os.getenv("STORAGE_API_MIN_ROWS", "1000"))  # Smaller results skip gRPC setup
+NDJSON_PAGE_SIZE = int(os.getenv("NDJSON_PAGE_SIZE", "10000"))  # Rows per BigQuery page when streaming
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "512"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "60"))
+DATES_CACHE_TTL = int(os.getenv("DATES_CACHE_TTL", "3600"))  # version_dates only change at ingest
+MAX_RANGE_DAYS = int(os.getenv("MAX_RANGE_DAYS", "366"))  # Longest start/end span a query may scan
 
 if not PROJECT_ID:
     raise RuntimeError("Set PROJECT_ID env (or use .env) before starting the API")
 
 # Initialize BigQuery client lazily to avoid startup errors
 bq = None
+bqstorage = None
+_bq_lock = threading.Lock()
 
 def get_bq_client():
-    global bq
+    global bq, bqstorage
     if bq is None:
-        bq = bigquery.Client(project=PROJECT_ID)
+        with _bq_lock:
+            if bq is None:
+                # requests pools 10 connections per host by default; endpoints run on
+                # FastAPI's worker threads, so size the pool to match and keep TLS warm
+                credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+                http = AuthorizedSession(credentials)
+                http.mount("https://", HTTPAdapter(pool_maxsize=BQ_POOL_SIZE))
+                if bigquery_storage is not None:
+                    bqstorage = bigquery_storage.BigQueryReadClient(credentials=credentials)
+                # Short dashboard reads (fast_query) let BigQuery skip creating a job,
+                # returning rows from a single jobs.query call
+                bq = bigquery.Client(project=PROJECT_ID, credentials=credentials, _http=http,
+                                     default_job_creation_mode="JOB_CREATION_OPTIONAL")
     return bq
 
+def query_rows(sql: str, params: Optional[list] = None, ttl: int = QUERY_CACHE_TTL) -> List[dict]:
+    """Run a query job and return its rows as dicts, cached in-process for ttl seconds."""
+    return cached_query(sql, params or [], ttl, lambda: rows_to_dicts(get_bq_client().query(
+        sql, job_config=bigquery.QueryJobConfig(query_parameters=params or [])
+    ).result()))
+
+def fast_query(sql: str, params: Optional[list] = None, ttl: int = QUERY_CACHE_TTL) -> List[dict]:
+    """Run a short query through jobs.query; cheap results come back inline without creating a job."""
+    return cached_query(sql, params or [], ttl, lambda: rows_to_dicts(get_bq_client().query_and_wait(
+        sql, job_config=bigquery.QueryJobConfig(query_parameters=params or [])
+    )))
+
+# Dashboards poll the same queries; identical (sql, params) within the TTL are
+# answered from memory without a BigQuery round trip
+_query_cache = OrderedDict()  # (sql, params) -> (expires_at, rows)
+_query_cache_lock = threading.Lock()
+_inflight = {}  # key -> Future of the query currently running for it
+# Per-request slot the X-Cache middleware reads back (a dict, so the worker
+# thread's write is visible to the middleware's context)
+_cache_status = ContextVar("cache_status", default=None)
+
+def cached_query(sql: str, params: list, ttl: int, run) -> List[dict]:
+    key = (sql, tuple((p.name, p.type_, p.value) for p in params))
+    now = time.monotonic()
+    with _query_cache_lock:
+        entry = _query_cache.get(key)
+        if entry is not None and entry[0] > now:
+            _query_cache.move_to_end(key)
+            _mark_cache("HIT")
+            return entry[1]
+        # Singleflight: concurrent misses for the same key share one BigQuery job
+        inflight = _inflight.get(key)
+        if inflight is None:
+            inflight = _inflight[key] = Future()
+            leader = True
+        else:
+            leader = False
+    
+    if not leader:
+        _mark_cache("HIT")
+        return inflight.result()
+    
+    try:
+        rows = run()
+    except BaseException as e:
+        with _query_cache_lock:
+            del _inflight[key]
+        inflight.set_exception(e)
+        raise
+    # Cache the rows and retire the in-flight entry under one lock, so a request
+    # arriving in between finds one or the other and never starts a second job
+    with _query_cache_lock:
+        _query_cache[key] = (time.monotonic() + ttl, rows)
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+        del _inflight[key]
+    inflight.set_result(rows)
+    _mark_cache("MISS")
+    return rows
+
+# Derived tables/views (infra/views.sql, the ingest refreshes) found missing from
+# DATASET, mapped to when to look for them again; meanwhile their endpoints
+# aggregate the base table instead
+_missing_tables = {}
+
+def query_derived(table: str, sql: str, fallback_sql: str, params: list, run=fast_query) -> List[dict]:
+    """Run sql, which reads the derived table, or fallback_sql over TABLE while
+    that table doesn't exist in the served dataset."""
+    if _missing_tables.get(table, 0) <= time.monotonic():
+        try:
+            return run(sql, params)
+        except NotFound:
+            print(f"{DATASET}.{table} not found; serving from {DATASET}.{TABLE}")
+            _missing_tables[table] = time.monotonic() + DATES_CACHE_TTL
+    return run(fallback_sql, params)
+
+# agency_metrics_daily computed on the fly from TABLE (same columns as
+# ingestion/derived_tables.py), for when the rollup table is missing
+AGENCY_METRICS_FALLBACK = f"""(
+        SELECT
+            version_date,
+            agency_name,
+            COUNT(*) AS sections_count,
+            COUNT(DISTINCT part_num) AS parts_count,
+            SUM(word_count) AS total_words,
+            SUM(regulatory_burden_score) AS burden_sum,
+            COUNT(regulatory_burden_score) AS burden_count,
+            AVG(regulatory_burden_score) AS avg_burden,
+            APPROX_QUANTILES(regulatory_burden_score, 2)[SAFE_OFFSET(1)] AS median_burden,
+            MAX(regulatory_burden_score) AS max_burden,
+            SUM(prohibition_count) AS total_prohibitions,
+            SUM(requirement_count) AS total_requirements,
+            SUM(enforcement_terms) AS total_enforcement,
+            SUM(temporal_references) AS total_deadlines,
+            SUM(dollar_mentions) AS total_cost_refs
+        FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+        GROUP BY version_date, agency_name
+    )"""
+
+def query_agency_metrics(sql: str, params: list) -> List[dict]:
+    """Run sql, which reads agency metrics from its {metrics} placeholder, against
+    AGENCY_METRICS_TABLE, or against AGENCY_METRICS_FALLBACK while that's missing.
+    Callers filter on version_date, which BigQuery pushes into the fallback."""
+    return query_derived(
+        AGENCY_METRICS_TABLE,
+        sql.format(metrics=f"`{PROJECT_ID}.{DATASET}.{AGENCY_METRICS_TABLE}`"),
+        sql.format(metrics=AGENCY_METRICS_FALLBACK),
+        params,
+        run=query_rows,
+    )
+
+def _mark_cache(status: str) -> None:
+    slot = _cache_status.get()
+    if slot is not None:
+        slot.setdefault("status", status)
+
+def rows_to_dicts(rows) -> List[dict]:
+    """Large results stream as Arrow over the Storage Read API when it is installed;
+    everything else is zipped against the schema once rather than per Row.
+    """
+    if bqstorage is not None and (rows.total_rows or 0) >= STORAGE_API_MIN_ROWS:
+        return rows.to_arrow(bqstorage_client=bqstorage).to_pylist()
+    fields = [f.name for f in rows.schema]
+    return [dict(zip(fields, r.values())) for r in rows]
+
+NDJSON = "application/x-ndjson"
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get("accept", "")
+
+async def stream_ndjson(sql: str, params: list) -> StreamingResponse:
+    """Stream rows as newline-delimited JSON as BigQuery pages arrive, for clients
+    sending Accept: application/x-ndjson. Large results are never held in full
+    here, so these bypass the query cache."""
+    job_config = bigquery.QueryJobConfig(query_parameters=params)
+    # Wait for the job before the response starts so query errors still return 500
+    rows = await asyncio.to_thread(
+        lambda: get_bq_client().query(sql, job_config=job_config).result(page_size=NDJSON_PAGE_SIZE))
+    fields = [f.name for f in rows.schema]
+
+    def lines():
+        for r in rows:
+            yield json.dumps(dict(zip(fields, r.values())), default=str) + "\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON)
+
 app = FastAPI(title="eCFR Analytics API", version="0.1.0")
 app.add_middleware(
     CORSMiddleware,
@@ -34,100 +225,167 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _parse_date(value: str) -> date:
+    """YYYY-MM-DD query value as a date, bound as a DATE parameter so BigQuery
+    can prune version_date partitions at plan time."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date '{value}', expected YYYY-MM-DD")
+
+def _parse_date_range(start_date: str, end_date: str) -> tuple:
+    """Validated (start, end) dates, at most MAX_RANGE_DAYS apart so one request
+    can't scan the whole table."""
+    start, end = _parse_date(start_date), _parse_date(end_date)
+    if end < start:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if (end - start).days > MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range exceeds {MAX_RANGE_DAYS} days")
+    return start, end
+
+@app.on_event("startup")
+async def size_query_executor():
+    """Endpoints are async and hand BigQuery calls to asyncio.to_thread; size its
+    default executor to the BigQuery connection pool rather than cpu_count + 4."""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=BQ_POOL_SIZE, thread_name_prefix="bq"))
+
+@app.middleware("http")
+async def cache_header(request: Request, call_next):
+    """Report X-Cache: HIT|MISS on responses served through the query cache."""
+    slot = {}
+    _cache_status.set(slot)
+    response = await call_next(request)
+    if "status" in slot:
+        response.headers["X-Cache"] = slot["status"]
+    return response
+
 @app.get("/healthz")
 def healthz():
     return {"ok": True}
 
 @app.get("/api/agency/wordcount")
-def agency_wordcount(date: str = Query(..., description="YYYY-MM-DD")):
+async def agency_wordcount(date: str = Query(..., description="YYYY-MM-DD")):
+    # Pre-aggregated by infra/views.sql; /api/part reads the base table, which is
+    # clustered by title_num/part_num so its filter only touches a narrow range.
     sql = f"""
+    SELECT agency_name, total_words
+    FROM `{PROJECT_ID}.{DATASET}.{AGENCY_WORDCOUNT_VIEW}`
+    WHERE version_date = @d
+    ORDER BY total_words DESC
+    """
+    fallback_sql = f"""
     SELECT agency_name, SUM(word_count) AS total_words
     FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-    WHERE version_date = DATE(@d)
+    WHERE version_date = @d
     GROUP BY agency_name
     ORDER BY total_words DESC
     """
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter("d", "STRING", date)]
-    ))
-    return [dict(r) for r in job.result()]
+    params = [bigquery.ScalarQueryParameter("d", "DATE", _parse_date(date))]
+    return await asyncio.to_thread(query_derived, AGENCY_WORDCOUNT_VIEW, sql, fallback_sql, params)
 
-@app.get("/api/agency/checksum")
-def agency_checksum(date: str = Query(..., description="YYYY-MM-DD")):
+# part_hashes computed on the fly from TABLE, for when the table is missing. The
+# XOR fold and section digest must stay identical to ingestion/derived_tables.py
+# (the API image ships main.py alone, so they are spelled out here)
+_PART_HASH_FOLD = "CONCAT(" + ", ".join(
+    f"FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(section_digest, {i}, 4))) AS INT64)))"
+    for i in range(1, 33, 4)
+) + ")"
+
+def _agency_hashes(date: str) -> list:
+    # Part hashes are precomputed at ingest, so the request only reads one small
+    # partition and XORs each agency's part hashes together here (order-independent,
+    # matching the XOR fold the part hashes themselves use). The read goes through
+    # the TTL cache, so a re-ingest or part-number fix shows up within QUERY_CACHE_TTL.
     sql = f"""
-    WITH parts AS (
-      SELECT
-        version_date,
-        agency_name,
-        part_num,
-        TO_HEX(SHA256(STRING_AGG(section_hash, '' ORDER BY section_citation))) AS part_hash
+    SELECT agency_name, part_hash
+    FROM `{PROJECT_ID}.{DATASET}.{PART_HASH_TABLE}`
+    WHERE version_date = @d
+    """
+    fallback_sql = f"""
+    SELECT ANY_VALUE(agency_name) AS agency_name, {_PART_HASH_FOLD} AS part_hash
+    FROM (
+      SELECT agency_name, title_num, part_num,
+             SHA256(CONCAT(section_citation, ':', section_hash)) AS section_digest
       FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-      WHERE version_date = DATE(@d)
-      GROUP BY version_date, agency_name, part_num
+      WHERE version_date = @d
     )
-    SELECT
-      agency_name,
-      TO_HEX(SHA256(STRING_AGG(part_hash, '' ORDER BY part_num))) AS agency_hash
-    FROM parts
-    GROUP BY agency_name
-    ORDER BY agency_name
+    GROUP BY title_num, part_num
     """
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter("d", "STRING", date)]
-    ))
-    return [dict(r) for r in job.result()]
+    params = [bigquery.ScalarQueryParameter("d", "DATE", _parse_date(date))]
+    rows = query_derived(PART_HASH_TABLE, sql, fallback_sql, params, run=query_rows)
+    hashes = {}
+    for r in rows:
+        hashes[r["agency_name"]] = hashes.get(r["agency_name"], 0) ^ int(r["part_hash"] or "0", 16)
+    return [{"agency_name": agency, "agency_hash": f"{h:064x}"} for agency, h in hashes.items()]
+
+@app.get("/api/agency/checksum")
+async def agency_checksum(date: str = Query(..., description="YYYY-MM-DD")):
+    return await asyncio.to_thread(_agency_hashes, date)
 
 # @app.get("/api/changes") - REMOVED - no longer tracking time-based changes
-def removed_changes():
+def removed_changes(
+    date_from: str = Query(..., description="Earlier snapshot YYYY-MM-DD"),
+    date_to: str = Query(..., description="Later snapshot YYYY-MM-DD"),
+):
+    # One pass over both snapshot partitions grouped by citation, rather than a
+    # FULL OUTER JOIN that shuffles both sides on the citation string.
     sql = f"""
-    WITH last AS (
-      SELECT section_citation, section_hash
-      FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-      WHERE version_date = DATE(@d1)
-    ),
-    now AS (
-      SELECT section_citation, section_hash
-      FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-      WHERE version_date = DATE(@d2)
-    )
     SELECT
-      COALESCE(now.section_citation, last.section_citation) AS section_citation,
+      section_citation,
       CASE
-        WHEN last.section_hash IS NULL THEN 'ADDED'
-        WHEN now.section_hash  IS NULL THEN 'REMOVED'
-        WHEN last.section_hash != now.section_hash THEN 'MODIFIED'
-        ELSE 'UNCHANGED'
+        WHEN last_hash IS NULL THEN 'ADDED'
+        WHEN now_hash  IS NULL THEN 'REMOVED'
+        ELSE 'MODIFIED'
       END AS change_type
-    FROM last
-    FULL OUTER JOIN now USING (section_citation)
-    WHERE NOT (last.section_hash = now.section_hash)
+    FROM (
+      SELECT
+        section_citation,
+        MAX(IF(version_date = @d1, section_hash, NULL)) AS last_hash,
+        MAX(IF(version_date = @d2, section_hash, NULL)) AS now_hash
+      FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+      WHERE version_date IN (@d1, @d2)
+      GROUP BY section_citation
+    )
+    WHERE last_hash IS DISTINCT FROM now_hash
     ORDER BY change_type, section_citation
     """
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("d1", "STRING", date_from),
-            bigquery.ScalarQueryParameter("d2", "STRING", date_to),
-        ]
-    ))
-    return [dict(r) for r in job.result()]
+    return query_rows(sql, [
+        bigquery.ScalarQueryParameter("d1", "DATE", _parse_date(date_from)),
+        bigquery.ScalarQueryParameter("d2", "DATE", _parse_date(date_to)),
+    ])
 
 @app.get("/api/part")
-def part(title: int, part: str, date: str):
+async def part(
+    request: Request,
+    title: int,
+    part: str,
+    date: str,
+    limit: Optional[int] = Query(None, ge=1, le=5000, description="Page size (default: whole part)"),
+    offset: int = Query(0, ge=0, description="Rows to skip"),
+):
+    page = "LIMIT @l OFFSET @o" if limit is not None else ""
     sql = f"""
     SELECT section_citation, section_heading, section_order, word_count,
            regulatory_burden_score, prohibition_count, requirement_count, enforcement_terms
     FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-    WHERE version_date = DATE(@d) AND title_num = @t AND part_num = @p
+    WHERE version_date = @d AND title_num = @t AND part_num = @p
     ORDER BY section_order
+    {page}
     """
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("d", "STRING", date),
-            bigquery.ScalarQueryParameter("t", "INT64", title),
-            bigquery.ScalarQueryParameter("p", "STRING", part),
+    params = [
+        bigquery.ScalarQueryParameter("d", "DATE", _parse_date(date)),
+        bigquery.ScalarQueryParameter("t", "INT64", title),
+        bigquery.ScalarQueryParameter("p", "STRING", part),
+    ]
+    if limit is not None:
+        params += [
+            bigquery.ScalarQueryParameter("l", "INT64", limit),
+            bigquery.ScalarQueryParameter("o", "INT64", offset),
         ]
-    ))
-    return [dict(r) for r in job.result()]
+    if wants_ndjson(request):
+        return await stream_ndjson(sql, params)
+    return await asyncio.to_thread(query_rows, sql, params)
 
 # ========================== ENHANCED HISTORICAL ENDPOINTS ==========================
 
@@ -138,7 +396,8 @@ def removed_agency_trends(
     agency: Optional[str] = Query(None, description="Filter by agency name")
 ):
     """Get historical word count trends by agency over time."""
-    where_clause = "WHERE version_date BETWEEN DATE(@start) AND DATE(@end)"
+    start, end = _parse_date_range(start_date, end_date)
+    where_clause = "WHERE version_date BETWEEN @start AND @end"
     if agency:
         where_clause += " AND agency_name = @agency"
     
@@ -146,43 +405,42 @@ def removed_agency_trends(
     SELECT 
         version_date,
         agency_name,
-        SUM(word_count) AS total_words,
-        AVG(regulatory_burden_score) AS avg_burden_score,
-        SUM(prohibition_count) AS total_prohibitions,
-        SUM(requirement_count) AS total_requirements,
-        SUM(enforcement_terms) AS total_enforcement_terms,
-        COUNT(DISTINCT part_num) AS parts_count,
-        COUNT(*) AS sections_count
-    FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+        total_words,
+        avg_burden AS avg_burden_score,
+        total_prohibitions,
+        total_requirements,
+        total_enforcement AS total_enforcement_terms,
+        parts_count,
+        sections_count
+    FROM {{metrics}}
     {where_clause}
-    GROUP BY version_date, agency_name
     ORDER BY version_date, agency_name
     """
     
     params = [
-        bigquery.ScalarQueryParameter("start", "STRING", start_date),
-        bigquery.ScalarQueryParameter("end", "STRING", end_date),
+        bigquery.ScalarQueryParameter("start", "DATE", start),
+        bigquery.ScalarQueryParameter("end", "DATE", end),
     ]
     if agency:
         params.append(bigquery.ScalarQueryParameter("agency", "STRING", agency))
     
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
-    return [dict(r) for r in job.result()]
+    return query_agency_metrics(sql, params)
 
 # @app.get("/api/historical/regulatory-burden") - REMOVED
 def regulatory_burden_trends(
     start_date: str = Query(..., description="Start date YYYY-MM-DD"),
     end_date: str = Query(..., description="End date YYYY-MM-DD"),
-    top_n: int = Query(10, description="Top N agencies by burden score")
+    top_n: int = Query(10, ge=1, le=100, description="Top N agencies by burden score")
 ):
     """Get regulatory burden trends for top agencies."""
+    start, end = _parse_date_range(start_date, end_date)
     sql = f"""
     WITH agency_avg_burden AS (
         SELECT 
             agency_name,
-            AVG(regulatory_burden_score) AS avg_burden
-        FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-        WHERE version_date BETWEEN DATE(@start) AND DATE(@end)
+            SAFE_DIVIDE(SUM(burden_sum), SUM(burden_count)) AS avg_burden
+        FROM {{metrics}}
+        WHERE version_date BETWEEN @start AND @end
         GROUP BY agency_name
         ORDER BY avg_burden DESC
         LIMIT @top_n
@@ -191,55 +449,64 @@ def regulatory_burden_trends(
         SELECT 
             t.version_date,
             t.agency_name,
-            AVG(t.regulatory_burden_score) AS avg_burden_score,
-            SUM(t.prohibition_count) AS total_prohibitions,
-            SUM(t.requirement_count) AS total_requirements,
-            SUM(t.enforcement_terms) AS total_enforcement,
-            COUNT(*) AS sections_count
-        FROM `{PROJECT_ID}.{DATASET}.{TABLE}` t
+            t.avg_burden AS avg_burden_score,
+            t.total_prohibitions,
+            t.total_requirements,
+            t.total_enforcement,
+            t.sections_count
+        FROM {{metrics}} t
         INNER JOIN agency_avg_burden a ON t.agency_name = a.agency_name
-        WHERE t.version_date BETWEEN DATE(@start) AND DATE(@end)
-        GROUP BY t.version_date, t.agency_name
+        WHERE t.version_date BETWEEN @start AND @end
     )
     SELECT * FROM trends
     ORDER BY version_date, avg_burden_score DESC
     """
     
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("start", "STRING", start_date),
-            bigquery.ScalarQueryParameter("end", "STRING", end_date),
-            bigquery.ScalarQueryParameter("top_n", "INT64", top_n),
-        ]
-    ))
-    return [dict(r) for r in job.result()]
+    return query_agency_metrics(sql, [
+        bigquery.ScalarQueryParameter("start", "DATE", start),
+        bigquery.ScalarQueryParameter("end", "DATE", end),
+        bigquery.ScalarQueryParameter("top_n", "INT64", top_n),
+    ])
 
 # @app.get("/api/historical/change-velocity") - REMOVED
 def change_velocity(
     start_date: str = Query(..., description="Start date YYYY-MM-DD"),
     end_date: str = Query(..., description="End date YYYY-MM-DD"),
-    window_months: int = Query(3, description="Rolling window in months")
+    window_months: int = Query(3, ge=1, le=24, description="Rolling window in months")
 ):
     """Get regulatory change velocity (sections changing per month)."""
+    start, end = _parse_date_range(start_date, end_date)
     sql = f"""
-    WITH section_changes AS (
-        SELECT 
-            section_citation,
-            version_date,
-            section_hash,
-            LAG(section_hash) OVER (
-                PARTITION BY section_citation 
-                ORDER BY version_date
-            ) AS prev_hash
+    WITH dates AS (
+        SELECT DISTINCT version_date
         FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-        WHERE version_date BETWEEN DATE(@start) AND DATE(@end)
+        WHERE version_date BETWEEN @start AND @end
+    ),
+    paired AS (
+        SELECT version_date, LAG(version_date) OVER (ORDER BY version_date) AS prev_date
+        FROM dates
+    ),
+    -- Each snapshot is compared with the one before it by joining the two
+    -- partitions on citation, instead of sorting every row by citation for LAG
+    section_changes AS (
+        SELECT 
+            a.section_citation,
+            a.version_date
+        FROM paired p
+        JOIN `{PROJECT_ID}.{DATASET}.{TABLE}` a
+          ON a.version_date = p.version_date
+        LEFT JOIN `{PROJECT_ID}.{DATASET}.{TABLE}` b
+          ON b.version_date = p.prev_date
+         AND b.section_citation = a.section_citation
+         AND b.version_date BETWEEN @start AND @end
+        WHERE a.version_date BETWEEN @start AND @end
+          AND a.section_hash != COALESCE(b.section_hash, '')
     ),
     monthly_changes AS (
         SELECT 
             DATE_TRUNC(version_date, MONTH) AS month,
             COUNT(DISTINCT section_citation) AS sections_changed
         FROM section_changes
-        WHERE section_hash != COALESCE(prev_hash, '')
         GROUP BY month
     )
     SELECT 
@@ -253,43 +520,37 @@ def change_velocity(
     ORDER BY month
     """
     
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("start", "STRING", start_date),
-            bigquery.ScalarQueryParameter("end", "STRING", end_date),
-            bigquery.ScalarQueryParameter("window_months", "INT64", window_months),
-        ]
-    ))
-    return [dict(r) for r in job.result()]
+    return query_rows(sql, [
+        bigquery.ScalarQueryParameter("start", "DATE", start),
+        bigquery.ScalarQueryParameter("end", "DATE", end),
+        bigquery.ScalarQueryParameter("window_months", "INT64", window_months),
+    ])
 
 @app.get("/api/metrics/burden-distribution")
-def burden_distribution(date: str = Query(..., description="Date YYYY-MM-DD")):
+async def burden_distribution(date: str = Query(..., description="Date YYYY-MM-DD")):
     """Get distribution of regulatory burden scores for a specific date."""
+    # Pre-aggregated per agency and date at ingest (ingestion/derived_tables.py)
     sql = f"""
     SELECT 
         agency_name,
-        COUNT(*) as sections_count,
-        AVG(regulatory_burden_score) as avg_burden,
-        APPROX_QUANTILES(regulatory_burden_score, 2)[SAFE_OFFSET(1)] as median_burden,
-        MAX(regulatory_burden_score) as max_burden,
-        SUM(prohibition_count) as total_prohibitions,
-        SUM(requirement_count) as total_requirements,
-        SUM(enforcement_terms) as total_enforcement,
-        SUM(temporal_references) as total_deadlines,
-        SUM(dollar_mentions) as total_cost_refs
-    FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-    WHERE version_date = DATE(@d)
-    GROUP BY agency_name
+        sections_count,
+        avg_burden,
+        median_burden,
+        max_burden,
+        total_prohibitions,
+        total_requirements,
+        total_enforcement,
+        total_deadlines,
+        total_cost_refs
+    FROM {{metrics}}
+    WHERE version_date = @d
     ORDER BY avg_burden DESC
     """
     
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter("d", "STRING", date)]
-    ))
-    return [dict(r) for r in job.result()]
+    return await asyncio.to_thread(query_agency_metrics, sql, [bigquery.ScalarQueryParameter("d", "DATE", _parse_date(date))])
 
 @app.get("/api/metrics/cost-analysis")
-def cost_analysis(date: str = Query(..., description="Date YYYY-MM-DD")):
+async def cost_analysis(date: str = Query(..., description="Date YYYY-MM-DD")):
     """Analyze sections with cost/financial references."""
     sql = f"""
     SELECT 
@@ -301,15 +562,12 @@ def cost_analysis(date: str = Query(..., description="Date YYYY-MM-DD")):
         regulatory_burden_score,
         word_count
     FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-    WHERE version_date = DATE(@d) AND dollar_mentions > 0
+    WHERE version_date = @d AND dollar_mentions > 0
     ORDER BY dollar_mentions DESC, enforcement_terms DESC
     LIMIT 50
     """
     
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter("d", "STRING", date)]
-    ))
-    return [dict(r) for r in job.result()]
+    return await asyncio.to_thread(query_rows, sql, [bigquery.ScalarQueryParameter("d", "DATE", _parse_date(date))])
 
 # @app.get("/api/available-dates") - REMOVED
 def available_dates():
@@ -319,15 +577,14 @@ def available_dates():
     FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
     ORDER BY version_date DESC
     """
-    job = get_bq_client().query(sql)
-    return [{"date": str(r["version_date"])} for r in job.result()]
+    return [{"date": str(r["version_date"])} for r in fast_query(sql, ttl=DATES_CACHE_TTL)]
 
 @app.get("/api/agencies")
-def agencies(date: Optional[str] = Query(None, description="Date YYYY-MM-DD, defaults to latest")):
+async def agencies(date: Optional[str] = Query(None, description="Date YYYY-MM-DD, defaults to latest")):
     """Get all agencies, optionally for a specific date."""
     if date:
-        where_clause = "WHERE version_date = DATE(@d)"
-        params = [bigquery.ScalarQueryParameter("d", "STRING", date)]
+        where_clause = "WHERE version_date = @d"
+        params = [bigquery.ScalarQueryParameter("d", "DATE", _parse_date(date))]
     else:
         where_clause = ""
         params = []
@@ -339,13 +596,12 @@ def agencies(date: Optional[str] = Query(None, description="Date YYYY-MM-DD, def
     ORDER BY agency_name
     """
     
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(query_parameters=params))
-    return [dict(r) for r in job.result()]
+    return await asyncio.to_thread(fast_query, sql, params)
 
 # ========================== ENHANCED BROWSING ENDPOINTS ==========================
 
 @app.get("/api/browse/titles")
-def browse_titles(date: str = Query(..., description="Date YYYY-MM-DD")):
+async def browse_titles(date: str = Query(..., description="Date YYYY-MM-DD")):
     """Browse all available titles with summary statistics."""
     sql = f"""
     SELECT 
@@ -358,19 +614,17 @@ def browse_titles(date: str = Query(..., description="Date YYYY-MM-DD")):
         SUM(COALESCE(requirement_count, 0)) as total_requirements,
         SUM(COALESCE(enforcement_terms, 0)) as total_enforcement
     FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-    WHERE version_date = DATE(@d)
+    WHERE version_date = @d
     GROUP BY title_num
     ORDER BY title_num
     """
     
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[bigquery.ScalarQueryParameter("d", "STRING", date)]
-    ))
-    return [dict(r) for r in job.result()]
+    return await asyncio.to_thread(query_rows, sql, [bigquery.ScalarQueryParameter("d", "DATE", _parse_date(date))])
 
 @app.get("/api/browse/parts")
-def browse_parts(title: int, date: str = Query(..., description="Date YYYY-MM-DD")):
+async def browse_parts(title: int, date: str = Query(..., description="Date YYYY-MM-DD")):
     """Browse all parts within a title with detailed statistics."""
+    version_date = _parse_date(date)
     try:
         sql = f"""
         WITH part_stats AS (
@@ -386,7 +640,7 @@ def browse_parts(title: int, date: str = Query(..., description="Date YYYY-MM-DD
               SUM(COALESCE(temporal_references, 0)) as total_deadlines,
               SUM(COALESCE(dollar_mentions, 0)) as total_cost_refs
           FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-          WHERE version_date = DATE(@d) AND title_num = @title
+          WHERE version_date = @d AND title_num = @title
           GROUP BY part_num
         ),
         top_burden_sections AS (
@@ -395,7 +649,7 @@ def browse_parts(title: int, date: str = Query(..., description="Date YYYY-MM-DD
               section_citation,
               ROW_NUMBER() OVER (PARTITION BY part_num ORDER BY COALESCE(regulatory_burden_score, 0) DESC) as rn
           FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-          WHERE version_date = DATE(@d) AND title_num = @title
+          WHERE version_date = @d AND title_num = @title
         )
         SELECT 
             p.*,
@@ -405,19 +659,17 @@ def browse_parts(title: int, date: str = Query(..., description="Date YYYY-MM-DD
         ORDER BY SAFE_CAST(p.part_num AS INT64)
         """
         
-        job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-            query_parameters=[
-                bigquery.ScalarQueryParameter("d", "STRING", date),
-                bigquery.ScalarQueryParameter("title", "INT64", title)
-            ]
-        ))
-        return [dict(r) for r in job.result()]
+        return await asyncio.to_thread(query_rows, sql, [
+            bigquery.ScalarQueryParameter("d", "DATE", version_date),
+            bigquery.ScalarQueryParameter("title", "INT64", title)
+        ])
     except Exception as e:
         print(f"Error in browse_parts: {e}")
         raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
 
 @app.get("/api/browse/sections")
-def browse_sections(
+async def browse_sections(
+    request: Request,
     title: int, 
     part: str, 
     date: str = Query(..., description="Date YYYY-MM-DD"),
@@ -457,23 +709,23 @@ def browse_sections(
         -- Complexity indicators
         (prohibition_count + requirement_count + enforcement_terms) as complexity_score
     FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-    WHERE version_date = DATE(@d) 
+    WHERE version_date = @d 
       AND title_num = @title 
       AND part_num = @part
     ORDER BY {sort_clause}
     """
     
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("d", "STRING", date),
-            bigquery.ScalarQueryParameter("title", "INT64", title),
-            bigquery.ScalarQueryParameter("part", "STRING", part)
-        ]
-    ))
-    return [dict(r) for r in job.result()]
+    params = [
+        bigquery.ScalarQueryParameter("d", "DATE", _parse_date(date)),
+        bigquery.ScalarQueryParameter("title", "INT64", title),
+        bigquery.ScalarQueryParameter("part", "STRING", part)
+    ]
+    if wants_ndjson(request):
+        return await stream_ndjson(sql, params)
+    return await asyncio.to_thread(query_rows, sql, params)
 
 @app.get("/api/browse/search")
-def browse_search(
+async def browse_search(
     query: str = Query(..., description="Search query"),
     date: str = Query(..., description="Date YYYY-MM-DD"),
     limit: int = Query(50, description="Result limit")
@@ -490,7 +742,7 @@ def browse_search(
         regulatory_burden_score,
         prohibition_count + requirement_count + enforcement_terms as complexity_score
     FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-    WHERE version_date = DATE(@d) 
+    WHERE version_date = @d 
       AND (
         LOWER(section_citation) LIKE LOWER(@query)
         OR LOWER(section_heading) LIKE LOWER(@query)
@@ -500,17 +752,14 @@ def browse_search(
     """
     
     search_pattern = f"%{query}%"
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("d", "STRING", date),
-            bigquery.ScalarQueryParameter("query", "STRING", search_pattern),
-            bigquery.ScalarQueryParameter("limit", "INT64", limit)
-        ]
-    ))
-    return [dict(r) for r in job.result()]
+    return await asyncio.to_thread(query_rows, sql, [
+        bigquery.ScalarQueryParameter("d", "DATE", _parse_date(date)),
+        bigquery.ScalarQueryParameter("query", "STRING", search_pattern),
+        bigquery.ScalarQueryParameter("limit", "INT64", limit)
+    ])
 
 @app.get("/api/section/text")
-def get_section_text(
+async def get_section_text(
     title: int,
     part: str, 
     section: str,
@@ -531,27 +780,23 @@ def get_section_text(
         dollar_mentions,
         agency_name
     FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-    WHERE version_date = DATE(@d) 
+    WHERE version_date = @d 
       AND title_num = @title 
       AND part_num = @part
       AND section_citation = @section
     LIMIT 1
     """
     
-    job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("d", "STRING", date),
-            bigquery.ScalarQueryParameter("title", "INT64", title),
-            bigquery.ScalarQueryParameter("part", "STRING", part),
-            bigquery.ScalarQueryParameter("section", "STRING", section)
-        ]
-    ))
-    
-    result = list(job.result())
+    result = await asyncio.to_thread(fast_query, sql, [
+        bigquery.ScalarQueryParameter("d", "DATE", _parse_date(date)),
+        bigquery.ScalarQueryParameter("title", "INT64", title),
+        bigquery.ScalarQueryParameter("part", "STRING", part),
+        bigquery.ScalarQueryParameter("section", "STRING", section)
+    ])
     if not result:
         raise HTTPException(status_code=404, detail="Section not found")
     
-    return dict(result[0])
+    return result[0]
 
 # ========================== AI ANALYSIS ENDPOINT ==========================
 
@@ -565,6 +810,7 @@ def analyze_section_with_ai(request: dict):
     
     if not all([section_citation, title, part, date]):
         raise HTTPException(status_code=400, detail="Missing required parameters")
+    version_date = _parse_date(date)
     
     try:
         # Get full section data from BigQuery
@@ -584,7 +830,7 @@ def analyze_section_with_ai(request: dict):
             title_num,
             part_num
         FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-        WHERE version_date = DATE(@d) 
+        WHERE version_date = @d 
           AND title_num = @title 
           AND part_num = @part
           AND section_citation = @section
@@ -593,7 +839,7 @@ def analyze_section_with_ai(request: dict):
         
         job = get_bq_client().query(sql, job_config=bigquery.QueryJobConfig(
             query_parameters=[
-                bigquery.ScalarQueryParameter("d", "STRING", date),
+                bigquery.ScalarQueryParameter("d", "DATE", version_date),
                 bigquery.ScalarQueryParameter("title", "INT64", int(title)),
                 bigquery.ScalarQueryParameter("part", "STRING", part),
                 bigquery.ScalarQueryParameter("section", "STRING", section_citation)
@@ -6,13 +6,22 @@ and upload them to Google Cloud Storage
 
 import os
 import sys
+import gzip
+import base64
+import hashlib
+import shutil
 import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from typing import List, Dict, Any
 import logging
 from google.cloud import storage
+from google.cloud.storage.retry import DEFAULT_RETRY
 import json
+from contextlib import ExitStack
 
 # Configure logging  
 log_dir = os.path.join(os.path.dirname(__file__), '..', 'logs')
@@ -33,55 +42,157 @@ GCS_BUCKET = "ecfr-xml-bulk-2025"
 BASE_URL = "https://www.govinfo.gov/bulkdata/ECFR"
 DATE = datetime.now().strftime("%Y-%m-%d")  # Current date for tracking
 LOCAL_DATA_DIR = "../data"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes per read from the response stream
+GCS_CHUNK_SIZE = 8 * 1024 * 1024  # Resumable upload chunk (multiple of 256 KiB)
+MAX_WORKERS = 8  # Titles downloaded concurrently
+REQUESTS_PER_SECOND = 4  # Request starts allowed against GovInfo across all workers
+
+# One pooled session shared by the download threads so TLS connections are reused
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+session.headers["Accept-Encoding"] = "gzip, deflate"
+
+# Storage client and bucket handle shared by every download thread
+_bucket = None
+_bucket_lock = threading.Lock()
+UPLOAD_RETRY = DEFAULT_RETRY.with_deadline(600)
+
+def get_bucket() -> storage.Bucket:
+    """Create the Storage client once (auth and metadata discovery) and reuse it"""
+    global _bucket
+    with _bucket_lock:
+        if _bucket is None:
+            _bucket = storage.Client().bucket(GCS_BUCKET)
+        return _bucket
+
+_rate_lock = threading.Lock()
+_next_request_at = 0.0
+
+def wait_for_rate_limit():
+    """Space request starts 1/REQUESTS_PER_SECOND apart across all threads"""
+    global _next_request_at
+    with _rate_lock:
+        now = time.monotonic()
+        wait = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + 1 / REQUESTS_PER_SECOND
+    if wait > 0:
+        time.sleep(wait)
+
+class TeeWriter:
+    """Forward each write to every sink, tracking the MD5 (as GCS reports it) and size"""
+    
+    def __init__(self, *sinks):
+        self.sinks = sinks
+        self.md5 = hashlib.md5()
+        self.size = 0
+    
+    def write(self, data) -> int:
+        for sink in self.sinks:
+            sink.write(data)
+        self.md5.update(data)
+        self.size += len(data)
+        return len(data)
+    
+    def flush(self) -> None:
+        for sink in self.sinks:
+            sink.flush()
 
 def get_xml_url(title: int) -> str:
     """Generate the URL for a specific CFR title XML file from GovInfo"""
     # GovInfo bulk XML URL pattern
     return f"{BASE_URL}/title-{title}/ECFR-title{title}.xml"
 
-def download_xml(title: int, date: str = DATE) -> Dict[str, Any]:
-    """Download a single CFR title XML file"""
+def download_xml(title: int, date: str = DATE, bucket: storage.Bucket = None,
+                 keep_local: bool = True) -> Dict[str, Any]:
+    """Download a single CFR title XML file
+    
+    The response is streamed straight into a resumable upload to
+    gs://GCS_BUCKET/{date}/ when a bucket is given, and written under
+    LOCAL_DATA_DIR only when keep_local is set. Objects already uploaded for
+    the date are never rewritten; without keep_local the title is skipped.
+    """
     url = get_xml_url(title)
-    local_path = os.path.join(LOCAL_DATA_DIR, f"ECFR-title{title}.xml")
+    local_path = os.path.join(LOCAL_DATA_DIR, f"ECFR-title{title}.xml") if keep_local else None
+    blob_name = f"{date}/ECFR-title{title}.xml"
     
     result = {
         "title": title,
         "url": url,
         "local_path": local_path,
+        "gcs_uploaded": False,
         "status": "pending",
         "size_mb": 0,
         "download_time": 0,
+        "md5": None,
         "error": None
     }
     
     try:
+        upload_blob = None
+        if bucket is not None:
+            blob = bucket.blob(blob_name)
+            if blob.exists(retry=UPLOAD_RETRY):
+                logger.info(f"⏭️ Title {title} already at gs://{GCS_BUCKET}/{blob_name}")
+                result["gcs_uploaded"] = True
+                if not keep_local:
+                    result["status"] = "exists"
+                    return result
+            else:
+                upload_blob = blob
+        
         logger.info(f"📥 Downloading Title {title} from {url}")
+        wait_for_rate_limit()
         start_time = time.time()
         
-        # Download with streaming to handle large files
-        response = requests.get(url, stream=True, timeout=300)
+        # Download with streaming to handle large files; the session asks for
+        # gzip/deflate and the raw stream decodes it as it is read
+        response = session.get(url, stream=True, timeout=300)
         response.raise_for_status()
+        response.raw.decode_content = True
         
-        # Write to local file
-        os.makedirs(os.path.dirname(local_path), exist_ok=True)
-        total_size = 0
+        # Fan each chunk out to GCS and/or the local file; a failed upload is
+        # cancelled rather than finalized when the with block exits on error
+        with ExitStack() as stack:
+            sinks = []
+            if upload_blob is not None:
+                logger.info(f"☁️ Streaming Title {title} to gs://{GCS_BUCKET}/{blob_name}")
+                # Stored gzip-compressed (the XML shrinks ~10x); GCS transcodes it
+                # back to plain XML for readers that don't accept gzip.
+                # if_generation_match=0: a concurrent run that created the object
+                # first gets a 412 instead of both uploading
+                upload_blob.content_encoding = "gzip"
+                writer = TeeWriter(stack.enter_context(upload_blob.open(
+                    "wb", chunk_size=GCS_CHUNK_SIZE, content_type="application/xml",
+                    if_generation_match=0, retry=UPLOAD_RETRY)))
+                sinks.append(stack.enter_context(gzip.GzipFile(fileobj=writer, mode="wb", compresslevel=6)))
+            if keep_local:
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                sinks.append(stack.enter_context(open(local_path, 'wb')))
+            
+            source = TeeWriter(*sinks)
+            shutil.copyfileobj(response.raw, source, DOWNLOAD_CHUNK_SIZE)
         
-        with open(local_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    total_size += len(chunk)
+        # Integrity: the object GCS finalized must hash to the bytes we sent
+        if upload_blob is not None:
+            upload_blob.reload(retry=UPLOAD_RETRY)
+            sent_md5 = base64.b64encode(writer.md5.digest()).decode()
+            if upload_blob.md5_hash != sent_md5:
+                upload_blob.delete(if_generation_match=upload_blob.generation, retry=UPLOAD_RETRY)
+                raise IOError(f"GCS object MD5 {upload_blob.md5_hash} does not match uploaded bytes {sent_md5}")
         
         download_time = time.time() - start_time
-        size_mb = total_size / (1024 * 1024)
+        size_mb = source.size / (1024 * 1024)
         
         result.update({
             "status": "downloaded",
+            "gcs_uploaded": bucket is not None,
             "size_mb": round(size_mb, 2),
-            "download_time": round(download_time, 2)
+            "download_time": round(download_time, 2),
+            "md5": source.md5.hexdigest()
         })
         
-        logger.info(f"✅ Title {title}: {size_mb:.2f} MB in {download_time:.2f}s")
+        encoding = response.headers.get("Content-Encoding", "identity")
+        logger.info(f"✅ Title {title}: {size_mb:.2f} MB in {download_time:.2f}s (transfer: {encoding})")
         return result
         
     except requests.exceptions.HTTPError as e:
@@ -97,29 +208,8 @@ def download_xml(title: int, date: str = DATE) -> Dict[str, Any]:
     
     return result
 
-def upload_to_gcs(local_path: str, title: int, date: str = DATE) -> bool:
-    """Upload XML file to Google Cloud Storage"""
-    try:
-        client = storage.Client()
-        bucket = client.bucket(GCS_BUCKET)
-        
-        # Create blob name with date folder structure
-        blob_name = f"{date}/ECFR-title{title}.xml"
-        blob = bucket.blob(blob_name)
-        
-        logger.info(f"☁️ Uploading Title {title} to gs://{GCS_BUCKET}/{blob_name}")
-        
-        # Upload with progress tracking
-        blob.upload_from_filename(local_path)
-        
-        logger.info(f"✅ Title {title} uploaded to GCS")
-        return True
-        
-    except Exception as e:
-        logger.error(f"❌ Failed to upload Title {title}: {e}")
-        return False
-
-def download_all_titles(titles: List[int] = None, upload: bool = True) -> Dict[str, Any]:
+def download_all_titles(titles: List[int] = None, upload: bool = True, max_workers: int = MAX_WORKERS,
+                        keep_local: bool = False) -> Dict[str, Any]:
     """Download all specified CFR titles"""
     if titles is None:
         titles = list(range(1, 51))  # All 50 titles
@@ -127,7 +217,8 @@ def download_all_titles(titles: List[int] = None, upload: bool = True) -> Dict[s
     logger.info(f"🚀 Starting bulk download of {len(titles)} CFR titles")
     logger.info(f"📅 Date: {DATE}")
     logger.info(f"☁️ GCS Bucket: {GCS_BUCKET}")
-    logger.info(f"📁 Local dir: {LOCAL_DATA_DIR}")
+    logger.info(f"📁 Local dir: {LOCAL_DATA_DIR if keep_local or not upload else '(not kept)'}")
+    logger.info(f"🧵 Workers: {max_workers} ({REQUESTS_PER_SECOND} req/s)")
     
     results = {
         "started_at": datetime.now().isoformat(),
@@ -135,41 +226,38 @@ def download_all_titles(titles: List[int] = None, upload: bool = True) -> Dict[s
         "titles_requested": len(titles),
         "titles_downloaded": 0,
         "titles_uploaded": 0,
+        "titles_skipped": 0,
         "total_size_mb": 0,
         "total_time": 0,
         "details": []
     }
     
     start_time = time.time()
+    bucket = get_bucket() if upload else None
+    # Without an upload the local copy is the only output
+    keep_local = keep_local or not upload
     
-    for title in titles:
-        # Add delay to avoid rate limiting
-        if title > 1:
-            time.sleep(2)  # 2 second delay between downloads
-        
-        # Download XML
-        download_result = download_xml(title, DATE)
-        results["details"].append(download_result)
-        
-        if download_result["status"] == "downloaded":
-            results["titles_downloaded"] += 1
-            results["total_size_mb"] += download_result["size_mb"]
+    # Download in parallel; wait_for_rate_limit keeps the request rate polite
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(download_xml, title, DATE, bucket, keep_local): title for title in titles}
+        for future in as_completed(futures):
+            download_result = future.result()
+            results["details"].append(download_result)
             
-            # Upload to GCS if requested
-            if upload:
-                if upload_to_gcs(download_result["local_path"], title, DATE):
+            if download_result["status"] == "downloaded":
+                results["titles_downloaded"] += 1
+                results["total_size_mb"] += download_result["size_mb"]
+                if download_result.get("gcs_uploaded"):
                     results["titles_uploaded"] += 1
-                    download_result["gcs_uploaded"] = True
-                else:
-                    download_result["gcs_uploaded"] = False
-                
-                # Optional: Delete local file after upload to save space
-                # os.remove(download_result["local_path"])
+            elif download_result["status"] == "exists":
+                results["titles_skipped"] += 1
     
+    results["details"].sort(key=lambda d: d["title"])
     results["total_time"] = round(time.time() - start_time, 2)
     results["completed_at"] = datetime.now().isoformat()
     
     # Save results summary
+    os.makedirs(LOCAL_DATA_DIR, exist_ok=True)
     summary_path = os.path.join(LOCAL_DATA_DIR, f"download_summary_{DATE}.json")
     with open(summary_path, 'w') as f:
         json.dump(results, f, indent=2)
@@ -180,6 +268,7 @@ def download_all_titles(titles: List[int] = None, upload: bool = True) -> Dict[s
     logger.info("=" * 60)
     logger.info(f"✅ Downloaded: {results['titles_downloaded']}/{results['titles_requested']} titles")
     logger.info(f"☁️ Uploaded to GCS: {results['titles_uploaded']} titles")
+    logger.info(f"⏭️ Already in GCS: {results['titles_skipped']} titles")
     logger.info(f"💾 Total size: {results['total_size_mb']:.2f} MB")
     logger.info(f"⏱️ Total time: {results['total_time']:.2f} seconds")
     logger.info(f"📁 Results saved to: {summary_path}")
@@ -196,6 +285,9 @@ def main():
                        help="Range of titles to download")
     parser.add_argument("--no-upload", action="store_true", help="Skip GCS upload")
     parser.add_argument("--date", default=DATE, help="Version date (YYYY-MM-DD)")
+    parser.add_argument("--keep-local", action="store_true",
+                       help=f"Also write the XML to {LOCAL_DATA_DIR} (always on with --no-upload)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="Concurrent downloads")
     
     args = parser.parse_args()
     
@@ -216,10 +308,11 @@ def main():
         download_date = DATE
     
     # Run download
-    results = download_all_titles(titles, upload=not args.no_upload)
+    results = download_all_titles(titles, upload=not args.no_upload, max_workers=args.workers,
+                                  keep_local=args.keep_local)
     
     # Exit with appropriate code
-    if results["titles_downloaded"] == results["titles_requested"]:
+    if results["titles_downloaded"] + results["titles_skipped"] == results["titles_requested"]:
         sys.exit(0)
     else:
         sys.exit(1)
@@ -5,10 +5,18 @@ Applies advanced part extraction to ALL titles and removes duplicates
 """
 
 import os
+import sys
+import itertools
 import logging
 from google.cloud import bigquery
 from typing import Dict
 
+
+# Part-number changes move part hashes and agency part counts; refresh them
+# with the shared helper
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "ingestion"))
+from derived_tables import refresh_derived_tables
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -21,6 +29,11 @@ PROJECT_ID = os.getenv("PROJECT_ID", "lawscan")
 DATASET = os.getenv("DATASET", "ecfr_enhanced")
 TABLE = os.getenv("TABLE", "sections_enhanced")
 
+# Part number prefix of a section number, first match wins:
+#   hyphenated (101-1.5 -> 101-1), letter suffix (15a.1 -> 15a, 16A.1 -> 16A),
+#   standard up to 4 digits (1234.5 -> 1234)
+PART_PATTERN = r'^(\d+-\d+|\d+[a-zA-Z]+|\d{1,4})\.'
+
 def remove_duplicates(client: bigquery.Client, dry_run: bool = True) -> Dict:
     """Remove duplicate sections (keeping the first occurrence)."""
     
@@ -39,13 +52,12 @@ def remove_duplicates(client: bigquery.Client, dry_run: bool = True) -> Dict:
         SELECT COUNT(*) as duplicate_groups, SUM(count - 1) as rows_to_delete
         FROM duplicates
         """
-        result = client.query(count_query).to_dataframe()
-        if not result.empty:
-            groups = result.iloc[0]['duplicate_groups'] or 0
-            rows = result.iloc[0]['rows_to_delete'] or 0
-            logger.info(f"🔍 Found {groups} duplicate section groups ({rows} extra rows to remove)")
-            return {"duplicate_groups": groups, "rows_to_delete": rows, "dry_run": True}
-        return {"duplicate_groups": 0, "rows_to_delete": 0, "dry_run": True}
+        # Aggregate query: always exactly one row, no DataFrame needed
+        row = next(iter(client.query(count_query).result()))
+        groups = row['duplicate_groups'] or 0
+        rows = row['rows_to_delete'] or 0
+        logger.info(f"🔍 Found {groups} duplicate section groups ({rows} extra rows to remove)")
+        return {"duplicate_groups": groups, "rows_to_delete": rows, "dry_run": True}
     else:
         # Delete duplicates keeping the first row
         delete_query = f"""
@@ -68,53 +80,25 @@ def remove_duplicates(client: bigquery.Client, dry_run: bool = True) -> Dict:
 def fix_all_letter_parts(client: bigquery.Client, dry_run: bool = True) -> Dict:
     """Fix letter suffix parts across ALL titles."""
     
+    # One REGEXP_EXTRACT per row yields the candidate part; rows where it is
+    # NULL (no pattern) or already equal are left alone
+    mismatched = f"""
+        section_num != 'unknown'
+        AND REGEXP_EXTRACT(section_num, r'{PART_PATTERN}') != part_num
+    """
     update_query = f"""
     UPDATE `{PROJECT_ID}.{DATASET}.{TABLE}`
-    SET 
-        part_num = CASE 
-            -- Hyphenated parts (101-1.5 -> 101-1)
-            WHEN REGEXP_CONTAINS(section_num, r'^\\d+-\\d+\\.')
-                THEN REGEXP_EXTRACT(section_num, r'^(\\d+-\\d+)\\.')
-            -- Letter suffix parts (15a.1 -> 15a, 16A.1 -> 16A)
-            WHEN REGEXP_CONTAINS(section_num, r'^\\d+[a-zA-Z]+\\.')
-                THEN REGEXP_EXTRACT(section_num, r'^(\\d+[a-zA-Z]+)\\.')
-            -- Standard pattern for reasonable lengths
-            WHEN REGEXP_CONTAINS(section_num, r'^\\d{{1,4}}\\.')
-                THEN REGEXP_EXTRACT(section_num, r'^(\\d{{1,4}})\\.')
-            ELSE part_num
-        END
-    WHERE 
-        section_num != 'unknown'
-        AND (
-            -- Update if pattern suggests different part
-            (REGEXP_CONTAINS(section_num, r'^\\d+-\\d+\\.') 
-                AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d+-\\d+)\\.'))
-            OR (REGEXP_CONTAINS(section_num, r'^\\d+[a-zA-Z]+\\.')
-                AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d+[a-zA-Z]+)\\.'))
-            OR (REGEXP_CONTAINS(section_num, r'^\\d{{1,4}}\\.')
-                AND LENGTH(REGEXP_EXTRACT(section_num, r'^(\\d{{1,4}})\\.')) <= 4
-                AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d{{1,4}})\\.'))
-        )
+    SET part_num = REGEXP_EXTRACT(section_num, r'{PART_PATTERN}')
+    WHERE {mismatched}
     """
     
     if dry_run:
         count_query = f"""
         SELECT COUNT(*) as affected_rows
         FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-        WHERE 
-            section_num != 'unknown'
-            AND (
-                (REGEXP_CONTAINS(section_num, r'^\\d+-\\d+\\.') 
-                    AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d+-\\d+)\\.'))
-                OR (REGEXP_CONTAINS(section_num, r'^\\d+[a-zA-Z]+\\.')
-                    AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d+[a-zA-Z]+)\\.'))
-                OR (REGEXP_CONTAINS(section_num, r'^\\d{{1,4}}\\.')
-                    AND LENGTH(REGEXP_EXTRACT(section_num, r'^(\\d{{1,4}})\\.')) <= 4
-                    AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d{{1,4}})\\.'))
-            )
+        WHERE {mismatched}
         """
-        result = client.query(count_query).to_dataframe()
-        affected = result.iloc[0]['affected_rows'] if not result.empty else 0
+        affected = next(iter(client.query(count_query).result()))['affected_rows']
         logger.info(f"🔍 Would update {affected} sections across all titles")
         return {"affected_rows": affected, "dry_run": True}
     else:
@@ -146,11 +130,11 @@ def check_suspicious_low_parts(client: bigquery.Client) -> None:
     """
     
     logger.info("\n🔍 Checking for suspicious low-number part assignments...")
-    results = client.query(query).to_dataframe()
+    results = client.query(query).result()
     
-    if not results.empty:
-        logger.info(f"Found {len(results)} suspicious part assignments:")
-        for _, row in results.head(10).iterrows():
+    if results.total_rows:
+        logger.info(f"Found {results.total_rows} suspicious part assignments:")
+        for row in itertools.islice(results, 10):
             sections = ', '.join(row['sample_sections'][:3])
             logger.info(f"  Title {row['title_num']} Part {row['part_num']}: {row['section_count']} sections (e.g., {sections})")
 
@@ -168,8 +152,7 @@ def verify_fixes(client: bigquery.Client) -> None:
     logger.info("\n🔍 Verifying fixes:")
     for label, query_template in test_queries:
         query = query_template.format(PROJECT_ID, DATASET, TABLE)
-        result = client.query(query).to_dataframe()
-        count = result.iloc[0]['c'] if not result.empty else 0
+        count = next(iter(client.query(query).result()))['c']
         status = "✅" if (count > 0 and "duplicate" not in label) or (count == 0 and "duplicate" in label) else "❌"
         logger.info(f"  {status} {label}: {count}")
 
@@ -183,7 +166,8 @@ def main():
         # Step 1: Remove duplicates
         logger.info("\n=== STEP 1: REMOVING DUPLICATES ===")
         dup_dry = remove_duplicates(client, dry_run=True)
-        if dup_dry.get("rows_to_delete", 0) > 0:
+        changed = dup_dry.get("rows_to_delete", 0) > 0
+        if changed:
             remove_duplicates(client, dry_run=False)
         
         # Step 2: Check suspicious assignments
@@ -195,6 +179,10 @@ def main():
         fix_dry = fix_all_letter_parts(client, dry_run=True)
         if fix_dry["affected_rows"] > 0:
             fix_all_letter_parts(client, dry_run=False)
+            changed = True
+        
+        if changed:
+            refresh_derived_tables(client, DATASET, TABLE)
         
         # Step 4: Verification
         logger.info("\n=== STEP 4: VERIFICATION ===")
@@ -6,9 +6,17 @@ Uses pattern matching on section numbers to determine correct part numbers
 """
 
 import os
+import sys
 import logging
 from google.cloud import bigquery
-from typing import Dict, List
+from typing import Dict, List, Optional
+
+
+# Part-number changes move part hashes and agency part counts; refresh them
+# with the shared helper
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "ingestion"))
+from derived_tables import refresh_derived_tables
+from table_rewrite import rewrite_table
 
 # Configure logging
 logging.basicConfig(
@@ -57,6 +65,8 @@ def identify_incorrect_part_numbers(client: bigquery.Client) -> List[Dict]:
         SPLIT(section_num, '.')[OFFSET(0)] != part_num
         AND section_num != 'unknown'
         AND part_num != 'unknown'
+        -- Cheap byte check before the regex: a part prefix needs a dot after it
+        AND STRPOS(section_num, '.') > 1
         AND REGEXP_CONTAINS(section_num, r'^[0-9]+\\.')
     GROUP BY title_num, part_num, section_num, section_citation
     ORDER BY title_num, CAST(part_num AS INT64), section_num
@@ -64,61 +74,59 @@ def identify_incorrect_part_numbers(client: bigquery.Client) -> List[Dict]:
     """
     
     logger.info("🔍 Identifying sections with incorrect part numbers...")
-    results = client.query(query).to_dataframe()
+    results = [dict(row) for row in client.query(query).result()]
     
-    if not results.empty:
+    if results:
         logger.info(f"Found {len(results)} section patterns with potential part number mismatches")
-        for _, row in results.head(10).iterrows():
+        for row in results[:10]:
             expected_part = extract_part_from_section_number(row['section_num'])
             logger.info(f"  {row['section_citation']}: part_num='{row['part_num']}' but section suggests part '{expected_part}'")
     else:
         logger.info("No obvious part number mismatches found")
     
-    return results.to_dict('records')
+    return results
 
-def fix_part_numbers_batch(client: bigquery.Client, dry_run: bool = True) -> Dict:
+def fix_part_numbers_batch(client: bigquery.Client, dry_run: bool = True,
+                           affected_rows: Optional[int] = None) -> Dict:
     """
     Fix part numbers by updating them based on section number patterns
+    Pass the dry-run's affected_rows when applying to skip counting again;
+    the applied count is then that pre-apply estimate.
     """
-    update_query = f"""
-    UPDATE `{PROJECT_ID}.{DATASET}.{TABLE}`
-    SET 
-        part_num = SPLIT(section_num, '.')[OFFSET(0)],
-        section_citation = CONCAT(CAST(title_num AS STRING), ' CFR § ', section_num)
-    WHERE 
-        -- Only update where section number suggests different part
-        SPLIT(section_num, '.')[OFFSET(0)] != part_num
-        AND section_num != 'unknown'
-        AND part_num != 'unknown' 
-        AND REGEXP_CONTAINS(section_num, r'^[0-9]+\\.')
-        AND LENGTH(SPLIT(section_num, '.')[OFFSET(0)]) <= 4  -- Sanity check: part numbers shouldn't be too long
-    """
-    
-    if dry_run:
-        # Count how many would be affected
-        count_query = f"""
-        SELECT COUNT(*) as affected_rows
-        FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-        WHERE 
+    # Only where section number suggests different part; part numbers
+    # longer than 4 digits are left alone as a sanity check, which the first
+    # dot's position settles before the regex has to run
+    needs_update = """
             SPLIT(section_num, '.')[OFFSET(0)] != part_num
             AND section_num != 'unknown'
             AND part_num != 'unknown' 
+            AND STRPOS(section_num, '.') BETWEEN 2 AND 5
             AND REGEXP_CONTAINS(section_num, r'^[0-9]+\\.')
-            AND LENGTH(SPLIT(section_num, '.')[OFFSET(0)]) <= 4
-        """
-        
-        result = client.query(count_query).to_dataframe()
-        affected_count = result.iloc[0]['affected_rows']
-        logger.info(f"🔍 DRY RUN: Would update {affected_count} sections")
-        return {"affected_rows": affected_count, "dry_run": True}
+    """
+    
+    # Count how many are affected
+    count_query = f"""
+    SELECT COUNT(*) as affected_rows
+    FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+    WHERE {needs_update}
+    """
+    
+    if affected_rows is None:
+        affected_rows = next(iter(client.query(count_query).result()))['affected_rows']
+    
+    if dry_run:
+        logger.info(f"🔍 DRY RUN: Would update {affected_rows} sections")
+        return {"affected_rows": affected_rows, "dry_run": True}
     
     else:
         logger.info("🔧 Executing part number corrections...")
-        job = client.query(update_query)
-        job.result()  # Wait for completion
+        rewrite_table(client, f"{PROJECT_ID}.{DATASET}.{TABLE}", f"""
+        IF({needs_update}, SPLIT(section_num, '.')[OFFSET(0)], part_num) AS part_num,
+        IF({needs_update}, CONCAT(CAST(title_num AS STRING), ' CFR § ', section_num), section_citation) AS section_citation
+        """)
         
-        logger.info(f"✅ Updated {job.num_dml_affected_rows} sections")
-        return {"affected_rows": job.num_dml_affected_rows, "dry_run": False}
+        logger.info(f"✅ Updated {affected_rows} sections (dry-run count)")
+        return {"affected_rows": affected_rows, "dry_run": False}
 
 def verify_corrections(client: bigquery.Client) -> Dict:
     """
@@ -137,13 +145,13 @@ def verify_corrections(client: bigquery.Client) -> Dict:
     ORDER BY section_num
     """
     
-    results = client.query(verification_query).to_dataframe()
+    rows = client.query(verification_query).result()
     logger.info(f"🔍 Verification - Title 6 Part 1003 sections:")
     
-    for _, row in results.iterrows():
+    for row in rows:
         logger.info(f"  {row['section_citation']}: part_num='{row['part_num']}' | {row['section_heading']}")
     
-    return {"verification_results": len(results)}
+    return {"verification_results": rows.total_rows}
 
 def main():
     """Main execution function"""
@@ -173,14 +181,17 @@ def main():
         logger.info(f"About to update {dry_result['affected_rows']} sections")
         
         # Execute the corrections
-        result = fix_part_numbers_batch(client, dry_run=False)
+        result = fix_part_numbers_batch(client, dry_run=False,
+                                        affected_rows=dry_result["affected_rows"])
+        
+        refresh_derived_tables(client, DATASET, TABLE)
         
         # Step 4: Verification
         logger.info("\n=== STEP 4: VERIFICATION ===")
         verify_corrections(client)
         
         logger.info(f"\n✅ Part number cleanup completed successfully!")
-        logger.info(f"Updated {result['affected_rows']} sections")
+        logger.info(f"Updated {result['affected_rows']} sections (dry-run count)")
         
     except Exception as e:
         logger.error(f"❌ Error during cleanup: {str(e)}")
@@ -9,11 +9,22 @@ Fixes incorrect part numbers in BigQuery with sophisticated pattern handling:
 """
 
 import os
+import sys
 import logging
 import re
+from functools import lru_cache
+from itertools import groupby, islice
+from operator import itemgetter
 from google.cloud import bigquery
 from typing import Dict, List, Optional, Tuple
 
+
+# Part-number changes move part hashes and agency part counts; refresh them
+# with the shared helper
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "ingestion"))
+from derived_tables import refresh_derived_tables
+from table_rewrite import rewrite_table
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -26,6 +37,40 @@ PROJECT_ID = os.getenv("PROJECT_ID", "lawscan")
 DATASET = os.getenv("DATASET", "ecfr_enhanced")
 TABLE = os.getenv("TABLE", "sections_enhanced")
 
+# Titles with known part number discrepancies from verification
+PROBLEMATIC_TITLES = [26, 29, 32, 38, 41, 42, 43, 44, 45, 46, 48, 49]
+
+# The Title 43 revert runs as this many UPDATEs, each over a FARM_FINGERPRINT
+# slice of the rows, so no single DML job carries the whole title
+REVERT_BUCKETS = int(os.getenv("REVERT_BUCKETS", "32"))
+
+# Candidate part from section_num as one anchored alternation, tried in order:
+# hyphenated (101-1.5 -> 101-1), letter suffix (15a.1 -> 15a),
+# special prefix (S 50.1 -> S 50), standard (1003.1 -> 1003)
+PART_PATTERN_SQL = r"r'^((?:\d+-\d+)|(?:\d+[a-zA-Z]+)|(?:[A-Z]+\s+\d+)|(?:\d{1,4}))\.'"
+
+# Persistent SQL UDF holding the pattern, so every query (and anyone querying
+# the dataset by hand) extracts parts with the same rule; created by main()
+EXTRACT_PART_UDF = f"`{PROJECT_ID}.{DATASET}.extract_part`"
+SUGGESTED_PART_SQL = f"{EXTRACT_PART_UDF}(section_num)"
+
+# Python side of the same patterns, compiled once and matched in a single scan.
+# "std" keeps any digit run so over-long parts can be reported rather than skipped
+_PART_RE = re.compile(
+    r'^(?:(?P<hyphen>\d+-\d+)|(?P<letter>\d+[a-zA-Z]+)|(?P<special>[A-Z]+\s+\d+)|(?P<std>\d+))\.\d+'
+)
+_RANGE_RE = re.compile(r'\d+-\d+.*\[RESERVED\]|\d+-\d+\s+\d+-\d+')
+_DIGITS_RE = re.compile(r'^\d+$')
+_LEVEL_RE = re.compile(r'^\d+[a-zA-Z]*$')
+
+_PATTERN_REASONS = {
+    "hyphen": "hyphenated part pattern",
+    "letter": "letter suffix pattern",
+    "special": "special prefix pattern",
+}
+
+# Pure on section_num, and section numbers repeat heavily across rows
+@lru_cache(maxsize=65536)
 def analyze_section_pattern(section_num: str) -> Tuple[Optional[str], str]:
     """
     Analyze section number to extract likely part number with sophisticated handling.
@@ -37,24 +82,14 @@ def analyze_section_pattern(section_num: str) -> Tuple[Optional[str], str]:
     # Clean up the section number
     section_num = section_num.strip()
     
-    # Pattern 1: Hyphenated parts like "101-1.5" -> Part "101-1"
-    # Matches patterns where hyphen is followed by a single digit before the dot
-    hyphen_match = re.match(r'^(\d+)-(\d+)\.(\d+)', section_num)
-    if hyphen_match:
-        part = f"{hyphen_match.group(1)}-{hyphen_match.group(2)}"
-        return part, f"hyphenated part pattern"
-    
-    # Pattern 2: Letter suffix parts like "15a.1", "16A.5" -> Part "15a", "16A"
-    letter_match = re.match(r'^(\d+[a-zA-Z]+)\.(\d+)', section_num)
-    if letter_match:
-        part = letter_match.group(1)
-        return part, f"letter suffix pattern"
+    match = _PART_RE.match(section_num)
     
-    # Pattern 3: Special prefix parts like "S 50.1" -> Part "S 50"
-    special_match = re.match(r'^([A-Z]+\s+\d+)\.(\d+)', section_num)
-    if special_match:
-        part = special_match.group(1)
-        return part, f"special prefix pattern"
+    # Patterns 1-3: hyphenated ("101-1.5" -> "101-1"), letter suffix
+    # ("15a.1" -> "15a") and special prefix ("S 50.1" -> "S 50") parts
+    if match:
+        group = match.lastgroup
+        if group in _PATTERN_REASONS:
+            return match.group(group), _PATTERN_REASONS[group]
     
     # Pattern 4: ECFR special identifiers
     if section_num.startswith("ECFR"):
@@ -63,13 +98,12 @@ def analyze_section_pattern(section_num: str) -> Tuple[Optional[str], str]:
     
     # Pattern 5: Range patterns like "1202-1219 [RESERVED] 1220-1239"
     # These are typically part identifiers themselves, not sections
-    if re.search(r'\d+-\d+.*\[RESERVED\]', section_num) or re.search(r'\d+-\d+\s+\d+-\d+', section_num):
+    if _RANGE_RE.search(section_num):
         return None, "range pattern - likely a part identifier"
     
     # Pattern 6: Standard numeric pattern like "1003.1" -> Part "1003"
-    standard_match = re.match(r'^(\d+)\.(\d+)', section_num)
-    if standard_match:
-        part = standard_match.group(1)
+    if match:
+        part = match.group("std")
         # Sanity check: part numbers typically aren't more than 4 digits
         if len(part) <= 4:
             return part, f"standard pattern"
@@ -77,7 +111,7 @@ def analyze_section_pattern(section_num: str) -> Tuple[Optional[str], str]:
             return None, f"part number too long ({len(part)} digits)"
     
     # Pattern 7: Just digits with no dot - could be a part reference itself
-    if re.match(r'^\d+$', section_num):
+    if _DIGITS_RE.match(section_num):
         # If it's just a number with no dot, it might be the part itself
         # But we should be cautious about this
         if len(section_num) <= 4:
@@ -89,21 +123,29 @@ def analyze_section_pattern(section_num: str) -> Tuple[Optional[str], str]:
     if section_num.count('.') > 1:
         # For multi-level, take the first component
         parts = section_num.split('.')
-        if parts[0] and re.match(r'^\d+[a-zA-Z]*$', parts[0]):
+        if parts[0] and _LEVEL_RE.match(parts[0]):
             if len(parts[0]) <= 5:  # Allow slightly longer for letter suffixes
                 return parts[0], "multi-level section"
     
     return None, f"unrecognized pattern: {section_num}"
 
+def create_extract_part_udf(client: bigquery.Client) -> None:
+    """
+    Create or refresh the extract_part UDF that SUGGESTED_PART_SQL calls.
+    """
+    ddl = f"""
+    CREATE OR REPLACE FUNCTION {EXTRACT_PART_UDF}(section_num STRING)
+    RETURNS STRING
+    AS (REGEXP_EXTRACT(section_num, {PART_PATTERN_SQL}))
+    """
+    client.query(ddl).result()
+
 def identify_problematic_parts(client: bigquery.Client, limit: int = 1000) -> List[Dict]:
     """
     Find sections where the part_num might need updating based on section_num patterns.
     Focuses on titles with known issues from verification.
     """
     
-    # Focus on titles with known discrepancies
-    problematic_titles = [26, 29, 32, 38, 41, 42, 43, 44, 45, 46, 48, 49]
-    
     query = f"""
     WITH analyzed AS (
         SELECT 
@@ -112,24 +154,12 @@ def identify_problematic_parts(client: bigquery.Client, limit: int = 1000) -> Li
             section_num,
             section_citation,
             -- Extract potential part from section_num
-            CASE 
-                -- Hyphenated parts (101-1.5 -> 101-1)
-                WHEN REGEXP_CONTAINS(section_num, r'^\\d+-\\d+\\.') 
-                    THEN REGEXP_EXTRACT(section_num, r'^(\\d+-\\d+)\\.')
-                -- Letter suffix parts (15a.1 -> 15a)
-                WHEN REGEXP_CONTAINS(section_num, r'^\\d+[a-zA-Z]+\\.')
-                    THEN REGEXP_EXTRACT(section_num, r'^(\\d+[a-zA-Z]+)\\.')
-                -- Special prefix (S 50.1 -> S 50)
-                WHEN REGEXP_CONTAINS(section_num, r'^[A-Z]+\\s+\\d+\\.')
-                    THEN REGEXP_EXTRACT(section_num, r'^([A-Z]+\\s+\\d+)\\.')
-                -- Standard pattern (1003.1 -> 1003)
-                WHEN REGEXP_CONTAINS(section_num, r'^\\d{{1,4}}\\.')
-                    THEN REGEXP_EXTRACT(section_num, r'^(\\d{{1,4}})\\.')
-                ELSE NULL
-            END as suggested_part
+            {SUGGESTED_PART_SQL} as suggested_part
         FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-        WHERE title_num IN ({','.join(map(str, problematic_titles))})
+        WHERE title_num IN ({','.join(map(str, PROBLEMATIC_TITLES))})
             AND section_num != 'unknown'
+            -- Every pattern ends in a dot after a non-empty part; cheap to check first
+            AND STRPOS(section_num, '.') > 1
     )
     SELECT 
         title_num,
@@ -147,96 +177,61 @@ def identify_problematic_parts(client: bigquery.Client, limit: int = 1000) -> Li
     """
     
     logger.info("🔍 Analyzing sections for advanced part number patterns...")
-    results = client.query(query).to_dataframe()
+    results = [dict(row) for row in client.query(query).result()]
     
-    if not results.empty:
+    if results:
         logger.info(f"Found {len(results)} section groups needing updates")
         
-        # Show sample of findings by title
-        for title in results['title_num'].unique()[:5]:
-            title_data = results[results['title_num'] == title]
+        # Show sample of findings by title (rows come back ordered by title_num)
+        by_title = groupby(results, key=itemgetter('title_num'))
+        for title, title_rows in islice(by_title, 5):
+            title_data = list(title_rows)
             logger.info(f"\n  Title {title}: {len(title_data)} patterns found")
-            for _, row in title_data.head(3).iterrows():
+            for row in title_data[:3]:
                 logger.info(f"    {row['section_citation']}: '{row['current_part']}' → '{row['suggested_part']}'")
     
-    return results.to_dict('records')
+    return results
 
-def update_part_numbers_advanced(client: bigquery.Client, dry_run: bool = True) -> Dict:
+def update_part_numbers_advanced(client: bigquery.Client, dry_run: bool = True,
+                                 affected_rows: Optional[int] = None) -> Dict:
     """
     Update part numbers using advanced pattern recognition.
+    Pass the dry-run's affected_rows when applying to skip counting again;
+    the applied count is then that pre-apply estimate.
     """
     
-    # Focus on titles with known issues
-    problematic_titles = [26, 29, 32, 38, 41, 42, 43, 44, 45, 46, 48, 49]
+    # Only rows where the extracted part differs; NULL (no pattern) keeps part_num
+    needs_update = f"""
+            title_num IN ({','.join(map(str, PROBLEMATIC_TITLES))})
+            AND section_num != 'unknown'
+            AND STRPOS(section_num, '.') > 1
+            AND {SUGGESTED_PART_SQL} != part_num
+    """
     
-    update_query = f"""
-    UPDATE `{PROJECT_ID}.{DATASET}.{TABLE}`
-    SET 
-        part_num = CASE 
-            -- Hyphenated parts (101-1.5 -> 101-1)
-            WHEN REGEXP_CONTAINS(section_num, r'^\\d+-\\d+\\.')
-                THEN REGEXP_EXTRACT(section_num, r'^(\\d+-\\d+)\\.')
-            -- Letter suffix parts (15a.1 -> 15a, 16A.1 -> 16A)
-            WHEN REGEXP_CONTAINS(section_num, r'^\\d+[a-zA-Z]+\\.')
-                THEN REGEXP_EXTRACT(section_num, r'^(\\d+[a-zA-Z]+)\\.')
-            -- Special prefix (S 50.1 -> S 50)
-            WHEN REGEXP_CONTAINS(section_num, r'^[A-Z]+\\s+\\d+\\.')
-                THEN REGEXP_EXTRACT(section_num, r'^([A-Z]+\\s+\\d+)\\.')
-            -- Standard pattern (1003.1 -> 1003) - only for reasonable lengths
-            WHEN REGEXP_CONTAINS(section_num, r'^\\d{{1,4}}\\.')
-                THEN REGEXP_EXTRACT(section_num, r'^(\\d{{1,4}})\\.')
-            ELSE part_num  -- Keep existing if no pattern matches
-        END,
-        -- Update citation to match
-        section_citation = CONCAT(CAST(title_num AS STRING), ' CFR § ', section_num)
-    WHERE 
-        title_num IN ({','.join(map(str, problematic_titles))})
-        AND section_num != 'unknown'
-        AND (
-            -- Only update if we can extract a different part
-            (REGEXP_CONTAINS(section_num, r'^\\d+-\\d+\\.') 
-                AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d+-\\d+)\\.'))
-            OR (REGEXP_CONTAINS(section_num, r'^\\d+[a-zA-Z]+\\.')
-                AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d+[a-zA-Z]+)\\.'))
-            OR (REGEXP_CONTAINS(section_num, r'^[A-Z]+\\s+\\d+\\.')
-                AND part_num != REGEXP_EXTRACT(section_num, r'^([A-Z]+\\s+\\d+)\\.'))
-            OR (REGEXP_CONTAINS(section_num, r'^\\d{{1,4}}\\.')
-                AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d{{1,4}})\\.'))
-        )
+    # Count affected rows
+    count_query = f"""
+    SELECT COUNT(*) as affected_rows
+    FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+    WHERE {needs_update}
     """
     
+    if affected_rows is None:
+        affected_rows = next(iter(client.query(count_query).result()))['affected_rows']
+    
     if dry_run:
-        # Count affected rows
-        count_query = f"""
-        SELECT COUNT(*) as affected_rows
-        FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-        WHERE 
-            title_num IN ({','.join(map(str, problematic_titles))})
-            AND section_num != 'unknown'
-            AND (
-                (REGEXP_CONTAINS(section_num, r'^\\d+-\\d+\\.') 
-                    AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d+-\\d+)\\.'))
-                OR (REGEXP_CONTAINS(section_num, r'^\\d+[a-zA-Z]+\\.')
-                    AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d+[a-zA-Z]+)\\.'))
-                OR (REGEXP_CONTAINS(section_num, r'^[A-Z]+\\s+\\d+\\.')
-                    AND part_num != REGEXP_EXTRACT(section_num, r'^([A-Z]+\\s+\\d+)\\.'))
-                OR (REGEXP_CONTAINS(section_num, r'^\\d{{1,4}}\\.')
-                    AND part_num != REGEXP_EXTRACT(section_num, r'^(\\d{{1,4}})\\.'))
-            )
-        """
-        
-        result = client.query(count_query).to_dataframe()
-        affected_count = result.iloc[0]['affected_rows'] if not result.empty else 0
-        logger.info(f"🔍 DRY RUN: Would update {affected_count} sections in problematic titles")
-        return {"affected_rows": affected_count, "dry_run": True}
+        logger.info(f"🔍 DRY RUN: Would update {affected_rows} sections in problematic titles")
+        return {"affected_rows": affected_rows, "dry_run": True}
     
     else:
         logger.info("🔧 Executing advanced part number corrections...")
-        job = client.query(update_query)
-        job.result()  # Wait for completion
+        rewrite_table(client, f"{PROJECT_ID}.{DATASET}.{TABLE}", f"""
+        IF({needs_update}, {SUGGESTED_PART_SQL}, part_num) AS part_num,
+        -- Update citation to match
+        IF({needs_update}, CONCAT(CAST(title_num AS STRING), ' CFR § ', section_num), section_citation) AS section_citation
+        """)
         
-        logger.info(f"✅ Updated {job.num_dml_affected_rows} sections")
-        return {"affected_rows": job.num_dml_affected_rows, "dry_run": False}
+        logger.info(f"✅ Updated {affected_rows} sections (dry-run count)")
+        return {"affected_rows": affected_rows, "dry_run": False}
 
 def verify_specific_fixes(client: bigquery.Client):
     """
@@ -252,14 +247,19 @@ def verify_specific_fixes(client: bigquery.Client):
     
     logger.info("\n🔍 Verifying specific fixes:")
     
+    # One grouped query for every case; the title/part IN lists can pair up
+    # extra combinations, which the lookup below just ignores
+    query = f"""
+    SELECT title_num, part_num, COUNT(*) as count
+    FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+    WHERE title_num IN ({','.join(str(t) for t, _, _ in test_cases)})
+        AND part_num IN ({','.join(f"'{p}'" for _, p, _ in test_cases)})
+    GROUP BY title_num, part_num
+    """
+    counts = {(row['title_num'], row['part_num']): row['count'] for row in client.query(query).result()}
+    
     for title_num, part_num, description in test_cases:
-        query = f"""
-        SELECT COUNT(*) as count
-        FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-        WHERE title_num = {title_num} AND part_num = '{part_num}'
-        """
-        result = client.query(query).to_dataframe()
-        count = result.iloc[0]['count'] if not result.empty else 0
+        count = counts.get((title_num, part_num), 0)
         
         if count > 0:
             logger.info(f"  ✅ {description}: {count} sections")
@@ -273,6 +273,10 @@ def revert_bad_fixes(client: bigquery.Client, dry_run: bool = True):
     """
     
     # Title 43 is the most problematic - it should have ~180 parts, not 499
+    revert_where = """title_num = 43
+        AND LENGTH(part_num) = 4
+        AND REGEXP_CONTAINS(part_num, r'^[2-9]\\d{3}$')"""
+    
     revert_query = f"""
     UPDATE `{PROJECT_ID}.{DATASET}.{TABLE}`
     SET 
@@ -294,32 +298,37 @@ def revert_bad_fixes(client: bigquery.Client, dry_run: bool = True):
                 THEN SUBSTRING(part_num, 1, 2)
             ELSE part_num
         END
-    WHERE title_num = 43
-        AND LENGTH(part_num) = 4
-        AND REGEXP_CONTAINS(part_num, r'^[2-9]\\d{{3}}$')
+    WHERE {revert_where}
+        -- One slice of the rows per job; see REVERT_BUCKETS
+        AND MOD(ABS(FARM_FINGERPRINT(section_citation)), {REVERT_BUCKETS}) = @bucket
     """
     
     if dry_run:
         count_query = f"""
         SELECT COUNT(*) as affected_rows
         FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
-        WHERE title_num = 43
-            AND LENGTH(part_num) = 4
-            AND REGEXP_CONTAINS(part_num, r'^[2-9]\\d{{3}}$')
+        WHERE {revert_where}
         """
         
-        result = client.query(count_query).to_dataframe()
-        affected_count = result.iloc[0]['affected_rows'] if not result.empty else 0
+        affected_count = next(iter(client.query(count_query).result()))['affected_rows']
         logger.info(f"🔄 DRY RUN: Would revert {affected_count} over-extracted parts in Title 43")
         return {"reverted_rows": affected_count, "dry_run": True}
     
     else:
-        logger.info("🔄 Reverting over-aggressive part extractions...")
-        job = client.query(revert_query)
-        job.result()
+        logger.info(f"🔄 Reverting over-aggressive part extractions in {REVERT_BUCKETS} batches...")
+        reverted = 0
+        # Sequential on purpose: BigQuery queues concurrent DML against the same
+        # table anyway, and each small job stays well clear of planner limits
+        for bucket in range(REVERT_BUCKETS):
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ScalarQueryParameter("bucket", "INT64", bucket)]
+            )
+            job = client.query(revert_query, job_config=job_config)
+            job.result()
+            reverted += job.num_dml_affected_rows or 0
         
-        logger.info(f"✅ Reverted {job.num_dml_affected_rows} rows")
-        return {"reverted_rows": job.num_dml_affected_rows, "dry_run": False}
+        logger.info(f"✅ Reverted {reverted} rows")
+        return {"reverted_rows": reverted, "dry_run": False}
 
 def main():
     """Main execution function"""
@@ -327,6 +336,7 @@ def main():
     
     try:
         client = bigquery.Client(project=PROJECT_ID)
+        create_extract_part_udf(client)
         
         # Step 1: Analyze problematic patterns
         logger.info("\n=== STEP 1: ANALYZING PATTERNS ===")
@@ -349,13 +359,18 @@ def main():
         
         if dry_result["affected_rows"] == 0:
             logger.info("✅ No advanced corrections needed!")
+            if revert_result["reverted_rows"] > 0:
+                refresh_derived_tables(client, DATASET, TABLE)
             return
         
         # Step 4: Execute the corrections
         logger.info(f"\n=== STEP 4: EXECUTING ADVANCED CORRECTIONS ===")
         logger.info(f"About to update {dry_result['affected_rows']} sections with advanced patterns")
         
-        result = update_part_numbers_advanced(client, dry_run=False)
+        result = update_part_numbers_advanced(client, dry_run=False,
+                                              affected_rows=dry_result["affected_rows"])
+        
+        refresh_derived_tables(client, DATASET, TABLE)
         
         # Step 5: Verification
         logger.info("\n=== STEP 5: VERIFICATION ===")
@@ -364,7 +379,7 @@ def main():
         # Final summary
         logger.info(f"\n✅ Advanced cleanup completed!")
         logger.info(f"   - Reverted {revert_result.get('reverted_rows', 0)} over-extracted parts")
-        logger.info(f"   - Updated {result['affected_rows']} sections with advanced patterns")
+        logger.info(f"   - Updated {result['affected_rows']} sections with advanced patterns (dry-run count)")
         logger.info(f"   - Now handling letter suffixes, hyphens, and special formats")
         
     except Exception as e:
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+In-place table rewrite shared by the part-number fix scripts.
+
+Rewrites every row in one CREATE OR REPLACE TABLE ... AS SELECT on the table's
+own name, so readers see either the old or the new table and never a gap. The
+new table carries the original partitioning, clustering and table options; the
+search and vector indexes the AI service relies on are recreated from their
+INFORMATION_SCHEMA DDL, and the rewrite fails loudly if that doesn't work.
+"""
+
+import json
+import logging
+from google.cloud import bigquery
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+def _sql_string(value: str) -> str:
+    # JSON string escapes are valid in BigQuery double-quoted literals
+    return json.dumps(value)
+
+def _partition_clause(table: bigquery.Table) -> str:
+    rp = table.range_partitioning
+    if rp is not None:
+        r = rp.range_
+        return f"PARTITION BY RANGE_BUCKET({rp.field}, GENERATE_ARRAY({r.start}, {r.end}, {r.interval}))"
+
+    tp = table.time_partitioning
+    if tp is None:
+        return ""
+    if tp.field is None:
+        raise ValueError(f"{table.full_table_id} is ingestion-time partitioned; "
+                         f"CREATE TABLE AS SELECT can't carry that partitioning over")
+    field_type = next(f.field_type for f in table.schema if f.name == tp.field)
+    if field_type == "DATE":
+        if tp.type_ == bigquery.TimePartitioningType.DAY:
+            return f"PARTITION BY {tp.field}"
+        return f"PARTITION BY DATE_TRUNC({tp.field}, {tp.type_})"
+    trunc = "DATETIME_TRUNC" if field_type == "DATETIME" else "TIMESTAMP_TRUNC"
+    return f"PARTITION BY {trunc}({tp.field}, {tp.type_})"
+
+def _cluster_clause(table: bigquery.Table) -> str:
+    if not table.clustering_fields:
+        return ""
+    return f"CLUSTER BY {', '.join(table.clustering_fields)}"
+
+def _options_clause(table: bigquery.Table) -> str:
+    options = []
+    if table.description:
+        options.append(f"description = {_sql_string(table.description)}")
+    if table.friendly_name:
+        options.append(f"friendly_name = {_sql_string(table.friendly_name)}")
+    if table.labels:
+        labels = ", ".join(f"({_sql_string(k)}, {_sql_string(v)})" for k, v in table.labels.items())
+        options.append(f"labels = [{labels}]")
+    if table.expires:
+        options.append(f"expiration_timestamp = TIMESTAMP {_sql_string(table.expires.isoformat())}")
+    tp = table.time_partitioning
+    if tp is not None and tp.expiration_ms:
+        options.append(f"partition_expiration_days = {tp.expiration_ms / 86_400_000}")
+    if table.require_partition_filter:
+        options.append("require_partition_filter = TRUE")
+    if not options:
+        return ""
+    return f"OPTIONS ({', '.join(options)})"
+
+def _index_ddls(client: bigquery.Client, table: bigquery.Table) -> Dict[str, str]:
+    """index_name -> CREATE ... INDEX DDL for the table's search and vector indexes."""
+    dataset = f"`{table.project}.{table.dataset_id}.INFORMATION_SCHEMA"
+    query = f"""
+    SELECT index_name, ddl FROM {dataset}.SEARCH_INDEXES` WHERE table_name = @t
+    UNION ALL
+    SELECT index_name, ddl FROM {dataset}.VECTOR_INDEXES` WHERE table_name = @t
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("t", "STRING", table.table_id)]
+    )
+    return {row['index_name']: row['ddl'] for row in client.query(query, job_config=job_config).result()}
+
+def rewrite_table(client: bigquery.Client, table_id: str, replace_sql: str) -> None:
+    """
+    Rewrite table_id in place as SELECT * REPLACE ({replace_sql}) FROM itself,
+    keeping its layout, options and indexes.
+    """
+    table = client.get_table(table_id)
+    indexes = _index_ddls(client, table)
+
+    layout = "\n    ".join(c for c in (_partition_clause(table), _cluster_clause(table), _options_clause(table)) if c)
+    ddl = f"""
+    CREATE OR REPLACE TABLE `{table_id}`
+    {layout}
+    AS SELECT * REPLACE ({replace_sql})
+    FROM `{table_id}`
+    """
+    client.query(ddl).result()
+
+    # Replacing the table can drop its indexes; put back any that are gone
+    missing = {name: index_ddl for name, index_ddl in indexes.items()
+               if name not in _index_ddls(client, table)}
+    for name, index_ddl in missing.items():
+        logger.info(f"🔁 Recreating index {name} on {table_id}")
+        try:
+            client.query(index_ddl).result()
+        except Exception as e:
+            raise RuntimeError(f"Rewrote {table_id} but could not recreate index {name}; "
+                               f"rerun its DDL by hand:\n{index_ddl}") from e
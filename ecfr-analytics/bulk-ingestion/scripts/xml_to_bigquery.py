@@ -18,6 +18,10 @@ import re
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
 
+# Shared derived-table refresh (part hashes, agency metrics) from the ingestion package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "ingestion"))
+from derived_tables import refresh_derived_tables
+
 # Configure logging  
 log_dir = os.path.join(os.path.dirname(__file__), '..', 'logs')
 os.makedirs(log_dir, exist_ok=True)
@@ -328,7 +332,9 @@ def extract_section_from_xml(section_node, title_num: int, title_name: str, snap
             "section_num": section_num,
             "section_citation": section_citation,
             "section_heading": heading,
+            "section_heading_norm": re.sub(r"[^a-z0-9 ]", "", (heading or "").lower()),  # Matched by the AI service's relevance scoring
             "section_text": cleaned_text,
+            "section_text_preview": cleaned_text[:1000],  # What the AI service reads for chat context
             "reserved": section_node.get("reserved", False),
             "agency_name": agency_name,
             "references": [],  # Could be extracted from text if needed
@@ -481,6 +487,9 @@ def process_all_xml_files(titles: List[int] = None, batch_size: int = 1000) -> D
                 "success": False
             })
     
+    if results["total_inserted"]:
+        refresh_derived_tables(client, DATASET, TABLE, [DATE])
+    
     results["total_time"] = round(time.time() - start_time, 2)
     results["completed_at"] = datetime.datetime.now().isoformat()
     
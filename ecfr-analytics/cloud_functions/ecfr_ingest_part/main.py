@@ -281,7 +281,9 @@ def process_section(section_node: Dict, title_data: Dict, part_data: Dict,
         "section_num": section_num,
         "section_citation": section_citation,
         "section_heading": section_heading,
+        "section_heading_norm": re.sub(r"[^a-z0-9 ]", "", (section_heading or "").lower()),  # Matched by the AI service's relevance scoring
         "section_text": section_text,
+        "section_text_preview": section_text[:1000],  # What the AI service reads for chat context
         "reserved": section_node.get("reserved", False),
         "agency_name": get_agency_from_title(title_num),
         "references": [],
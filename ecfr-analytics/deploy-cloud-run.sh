@@ -9,6 +9,7 @@ PROJECT_ID="${PROJECT_ID:-lawscan}"
 SERVICE_NAME="${SERVICE_NAME:-ecfr-analytics}"
 REGION="${REGION:-us-central1}"
 GEMINI_API_KEY="${GEMINI_API_KEY}"
+AI_SERVICE_NAME="${AI_SERVICE_NAME}"  # optional: Cloud Run AI service to open CORS for
 
 if [ -z "$GEMINI_API_KEY" ]; then
     echo "❌ Error: GEMINI_API_KEY environment variable is required"
@@ -54,6 +55,16 @@ gcloud run deploy $SERVICE_NAME \
 # Get the service URL
 SERVICE_URL=$(gcloud run services describe $SERVICE_NAME --platform managed --region $REGION --format 'value(status.url)')
 
+# The AI service only accepts browser calls from CORS_ORIGINS; allow the deployed UI
+CORS_ORIGINS="${CORS_ORIGINS:-$SERVICE_URL,http://localhost:8080}"
+if [ -n "$AI_SERVICE_NAME" ]; then
+    echo "🔧 Allowing $SERVICE_URL on AI service $AI_SERVICE_NAME..."
+    gcloud run services update $AI_SERVICE_NAME \
+        --platform managed \
+        --region $REGION \
+        --update-env-vars="^@^CORS_ORIGINS=$CORS_ORIGINS"
+fi
+
 echo ""
 echo "🎉 Deployment complete!"
 echo "📱 Service URL: $SERVICE_URL"
@@ -62,6 +73,9 @@ echo "🔧 Next steps:"
 echo "1. Ensure your BigQuery dataset 'ecfr_enhanced' contains data"
 echo "2. Test the deployment: curl $SERVICE_URL/health"
 echo "3. Access the UI: $SERVICE_URL"
+if [ -z "$AI_SERVICE_NAME" ]; then
+    echo "4. Run the AI service with CORS_ORIGINS=$CORS_ORIGINS so the UI can reach it"
+fi
 echo ""
 echo "💡 To update environment variables:"
 echo "   gcloud run services update $SERVICE_NAME --region $REGION --set-env-vars=\"GEMINI_API_KEY=new-key\""
\ No newline at end of file
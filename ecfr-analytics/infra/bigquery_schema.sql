@@ -54,4 +54,16 @@ CREATE TABLE IF NOT EXISTS ecfr.sections (
   embedding_optimized_text STRING
 )
 PARTITION BY version_date
-CLUSTER BY title_num, agency_name, part_num;
+CLUSTER BY title_num, part_num, agency_name;
+
+-- The API filters every query on version_date, and part/browse lookups on
+-- title_num then part_num; agency totals come from mv_agency_wordcount_daily.
+-- Tables created before this layout (CREATE IF NOT EXISTS leaves them as is)
+-- are rebuilt once, then the names swapped:
+--   CREATE TABLE ecfr.sections_v2
+--   PARTITION BY version_date
+--   CLUSTER BY title_num, part_num, agency_name
+--   AS SELECT * FROM ecfr.sections;
+--   -- after verifying row counts match:
+--   DROP TABLE ecfr.sections;
+--   ALTER TABLE ecfr.sections_v2 RENAME TO sections;
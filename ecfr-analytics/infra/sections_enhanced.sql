@@ -0,0 +1,61 @@
+-- BigQuery DDL — partition/cluster layout for the enhanced section table
+-- read by the AI service. Chat searches always filter on version_date and,
+-- for citation lookups, title_num / part_num / section_citation.
+
+-- Every statement below applies to the live table and is safe to re-run.
+-- Tables created before this layout are rebuilt once by the step at the end.
+
+-- Inverted index behind the chat keyword search's SEARCH() predicates
+-- (a table has one search index; drop and recreate it to change columns)
+CREATE SEARCH INDEX IF NOT EXISTS sections_text_idx
+ON ecfr_enhanced.sections_enhanced (section_text, section_heading, ai_context_summary);
+
+-- Section embeddings for the chat's VECTOR_SEARCH retrieval, filled per
+-- version_date by scripts/embed_sections.py (768-dim, textembedding-gecko)
+ALTER TABLE ecfr_enhanced.sections_enhanced
+ADD COLUMN IF NOT EXISTS embedding ARRAY<FLOAT64>;
+
+-- version_date and section_citation are stored in the index so the AI
+-- service's date pre-filter runs inside it instead of falling back to a brute
+-- force scan. An index created without STORING has to be dropped first:
+--   DROP VECTOR INDEX sections_vec_idx ON ecfr_enhanced.sections_enhanced;
+CREATE VECTOR INDEX IF NOT EXISTS sections_vec_idx
+ON ecfr_enhanced.sections_enhanced (embedding)
+STORING (version_date, section_citation)
+OPTIONS (index_type = 'IVF', distance_type = 'COSINE');
+
+-- 1 bit per embedding dimension (96 bytes) for the optional Hamming-distance
+-- shortlist (VECTOR_SEARCH_QUANTIZED=true in the AI service)
+ALTER TABLE ecfr_enhanced.sections_enhanced
+ADD COLUMN IF NOT EXISTS embedding_bits BYTES;
+
+-- First 1000 chars of section_text, written by the ingest jobs; the AI service
+-- reads this instead of the full text. Backfill rows loaded before it existed:
+ALTER TABLE ecfr_enhanced.sections_enhanced
+ADD COLUMN IF NOT EXISTS section_text_preview STRING;
+
+UPDATE ecfr_enhanced.sections_enhanced
+SET section_text_preview = SUBSTR(section_text, 1, 1000)
+WHERE section_text_preview IS NULL;
+
+-- Lowercased heading with punctuation stripped, written by the ingest jobs for
+-- the chat relevance score (STRPOS instead of LOWER + LIKE per row). Backfill:
+ALTER TABLE ecfr_enhanced.sections_enhanced
+ADD COLUMN IF NOT EXISTS section_heading_norm STRING;
+
+UPDATE ecfr_enhanced.sections_enhanced
+SET section_heading_norm = REGEXP_REPLACE(LOWER(section_heading), r'[^a-z0-9 ]', '')
+WHERE section_heading_norm IS NULL AND section_heading IS NOT NULL;
+
+-- One-time layout rebuild, for a table created before it. Run by hand after
+-- the statements above, so the copy carries every column added here:
+--   CREATE TABLE ecfr_enhanced.sections_enhanced_clustered
+--   PARTITION BY version_date
+--   CLUSTER BY title_num, part_num, section_citation
+--   AS SELECT * FROM ecfr_enhanced.sections_enhanced;
+--   -- after verifying row counts match:
+--   DROP TABLE ecfr_enhanced.sections_enhanced;
+--   ALTER TABLE ecfr_enhanced.sections_enhanced_clustered RENAME TO sections_enhanced;
+-- Indexes don't survive the swap: run this file once more straight away to
+-- recreate sections_text_idx and sections_vec_idx on the renamed table (the
+-- chat keyword and vector searches need both).
@@ -1,5 +1,12 @@
--- Per-part daily rollup (deterministic content hash by ordered child hashes)
-CREATE OR REPLACE TABLE ecfr.parts_daily AS
+-- Derived tables and views, created in the same dataset as the section table the
+-- API serves (DATASET/TABLE in its environment). Apply with, e.g.:
+--   DATASET=ecfr_enhanced TABLE=sections_enhanced envsubst < infra/views.sql \
+--     | bq query --use_legacy_sql=false
+
+-- Per-part daily rollup. Content hashes are an order-independent XOR of each
+-- section's SHA256(citation:section_hash), folded as eight 4-byte words since
+-- BIT_XOR only takes INT64 (see xor_hash_sql in ingestion/ecfr_ingest.py)
+CREATE OR REPLACE TABLE ${DATASET}.parts_daily AS
 SELECT
   version_date,
   ANY_VALUE(snapshot_ts) AS snapshot_ts,
@@ -9,17 +16,95 @@ SELECT
   part_num, ANY_VALUE(part_label) AS part_label,
   ANY_VALUE(agency_name) AS agency_name,
   SUM(word_count) AS part_word_count,
-  TO_HEX(SHA256(STRING_AGG(section_hash, '' ORDER BY section_citation))) AS part_hash
-FROM ecfr.sections
+  CONCAT(
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(section_digest, 1, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(section_digest, 5, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(section_digest, 9, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(section_digest, 13, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(section_digest, 17, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(section_digest, 21, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(section_digest, 25, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(section_digest, 29, 4))) AS INT64)))) AS part_hash
+FROM (SELECT *, SHA256(CONCAT(section_citation, ':', section_hash)) AS section_digest FROM ${DATASET}.${TABLE})
 GROUP BY version_date, title_num, part_num;
 
 -- Per-agency daily rollup
-CREATE OR REPLACE TABLE ecfr.agency_daily AS
+CREATE OR REPLACE TABLE ${DATASET}.agency_daily AS
 SELECT
   version_date,
   agency_name,
   ANY_VALUE(snapshot_ts) AS snapshot_ts,
   SUM(part_word_count) AS agency_word_count,
-  TO_HEX(SHA256(STRING_AGG(part_hash, '' ORDER BY title_num, part_num))) AS agency_hash
-FROM ecfr.parts_daily
+  CONCAT(
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(FROM_HEX(part_hash), 1, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(FROM_HEX(part_hash), 5, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(FROM_HEX(part_hash), 9, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(FROM_HEX(part_hash), 13, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(FROM_HEX(part_hash), 17, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(FROM_HEX(part_hash), 21, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(FROM_HEX(part_hash), 25, 4))) AS INT64))),
+    FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR(FROM_HEX(part_hash), 29, 4))) AS INT64)))) AS agency_hash
+FROM ${DATASET}.parts_daily
 GROUP BY version_date, agency_name;
+
+-- Per-agency daily word counts behind /api/agency/wordcount.
+-- Refreshed incrementally by BigQuery as new snapshots land in ${DATASET}.${TABLE}.
+CREATE MATERIALIZED VIEW IF NOT EXISTS ${DATASET}.mv_agency_wordcount_daily
+PARTITION BY version_date
+CLUSTER BY agency_name
+OPTIONS (enable_refresh = true, refresh_interval_minutes = 60)
+AS
+SELECT
+  version_date,
+  agency_name,
+  SUM(word_count) AS total_words
+FROM ${DATASET}.${TABLE}
+GROUP BY version_date, agency_name;
+
+-- Optional: serve the recurring API aggregations from memory (adjust project/region/size)
+-- ALTER BI_CAPACITY `PROJECT_ID.region-us.default`
+-- SET OPTIONS (
+--   size_gb = 2,
+--   preferred_tables = ['PROJECT_ID.${DATASET}.${TABLE}', 'PROJECT_ID.${DATASET}.mv_agency_wordcount_daily']
+-- );
+
+-- Per-part content hashes behind /api/agency/checksum, kept current for each
+-- loaded date by every ingest path and part-number fix script
+-- (ingestion/derived_tables.py refresh_derived_tables). Rows written before the
+-- XOR fold hold ordered-concatenation hashes; run
+-- `python ingestion/derived_tables.py --dataset ... --table ...` once to rebuild
+-- every date so checksums stay comparable.
+CREATE TABLE IF NOT EXISTS ${DATASET}.part_hashes (
+  version_date DATE NOT NULL,
+  agency_name  STRING,
+  title_num    INT64 NOT NULL,
+  part_num     STRING,
+  part_hash    STRING
+)
+PARTITION BY version_date
+CLUSTER BY agency_name;
+
+-- Per-agency daily metrics behind /api/metrics/burden-distribution and the
+-- historical trend queries, refreshed for each loaded date by every ingest path
+-- and part-number fix script (ingestion/derived_tables.py refresh_derived_tables). burden_sum / burden_count give
+-- exact averages across date ranges; APPROX_QUANTILES and COUNT(DISTINCT) rule
+-- out an incrementally maintained materialized view here.
+CREATE TABLE IF NOT EXISTS ${DATASET}.agency_metrics_daily (
+  version_date       DATE NOT NULL,
+  agency_name        STRING,
+  sections_count     INT64,
+  parts_count        INT64,
+  total_words        INT64,
+  burden_sum         FLOAT64,
+  burden_count       INT64,
+  avg_burden         FLOAT64,
+  median_burden      FLOAT64,
+  max_burden         FLOAT64,
+  total_prohibitions INT64,
+  total_requirements INT64,
+  total_enforcement  INT64,
+  total_deadlines    INT64,
+  total_cost_refs    INT64
+)
+PARTITION BY version_date
+CLUSTER BY agency_name;
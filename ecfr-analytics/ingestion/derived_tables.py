@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Derived tables the API serves next to the section table (part_hashes,
+agency_metrics_daily).
+
+Every path that writes or rewrites section rows calls refresh_derived_tables
+for the dataset/table it wrote, so the rollups never lag the rows they summarise:
+ecfr_ingest.py, scripts/local_parallel_ingestion.py, the Cloud Function
+orchestrator (scripts/deploy_parallel_ingestion.py), bulk-ingestion's
+xml_to_bigquery.py and part-number fix scripts, and scripts/load_ndjson.sh via
+this module's command line.
+"""
+import argparse, sys
+from typing import List, Optional
+from google.cloud import bigquery
+
+def xor_hash_sql(hash_bytes: str) -> str:
+    """SQL aggregate XOR-folding a group's 32-byte hashes into one hex digest.
+
+    XOR is order-independent, so groups need no sort and no concatenated
+    string. BIT_XOR only takes INT64, so each hash is folded as eight 4-byte words.
+    """
+    words = [
+        f"FORMAT('%08x', BIT_XOR(CAST(CONCAT('0x', TO_HEX(SUBSTR({hash_bytes}, {i}, 4))) AS INT64)))"
+        for i in range(1, 33, 4)
+    ]
+    return "CONCAT(\n    " + ",\n    ".join(words) + ")"
+
+# Section hashes only cover the text, so identical sections (e.g. "[Reserved]")
+# would cancel under XOR; each is bound to its citation first
+SECTION_DIGEST_SQL = "SHA256(CONCAT(section_citation, ':', section_hash))"
+
+def _dates_filter(version_dates: Optional[List[str]]) -> tuple:
+    """WHERE predicate and job config for the given dates, or every date when None."""
+    if version_dates is None:
+        return "TRUE", bigquery.QueryJobConfig()
+    return "version_date IN UNNEST(@dates)", bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("dates", "DATE", version_dates)]
+    )
+
+def refresh_part_hashes(client: bigquery.Client, dataset_id: str, table_name: str,
+                        version_dates: Optional[List[str]] = None) -> None:
+    """Recompute the per-part content hashes for the given snapshot dates (all when None)."""
+    dates_filter, job_config = _dates_filter(version_dates)
+    script = """
+CREATE TABLE IF NOT EXISTS {dataset}.part_hashes (
+  version_date DATE NOT NULL,
+  agency_name  STRING,
+  title_num    INT64 NOT NULL,
+  part_num     STRING,
+  part_hash    STRING
+)
+PARTITION BY version_date
+CLUSTER BY agency_name;
+
+DELETE FROM {dataset}.part_hashes
+WHERE {dates_filter};
+
+INSERT INTO {dataset}.part_hashes (version_date, agency_name, title_num, part_num, part_hash)
+SELECT
+  version_date,
+  ANY_VALUE(agency_name) AS agency_name,
+  title_num,
+  part_num,
+  {part_hash} AS part_hash
+FROM (
+  SELECT version_date, agency_name, title_num, part_num, {section_digest} AS section_digest
+  FROM {dataset}.{table}
+  WHERE {dates_filter}
+)
+GROUP BY version_date, title_num, part_num;
+    """.format(dataset=dataset_id, table=table_name, dates_filter=dates_filter,
+               section_digest=SECTION_DIGEST_SQL, part_hash=xor_hash_sql("section_digest"))
+
+    scope = f"{len(version_dates)} date(s)" if version_dates is not None else "all dates"
+    print(f"Refreshing part hashes in {dataset_id} for {scope}", file=sys.stderr)
+    client.query(script, job_config=job_config).result()
+
+def refresh_agency_metrics(client: bigquery.Client, dataset_id: str, table_name: str,
+                           version_dates: Optional[List[str]] = None) -> None:
+    """Recompute the per-agency daily metric rollup for the given snapshot dates (all when None)."""
+    dates_filter, job_config = _dates_filter(version_dates)
+    script = """
+CREATE TABLE IF NOT EXISTS {dataset}.agency_metrics_daily (
+  version_date       DATE NOT NULL,
+  agency_name        STRING,
+  sections_count     INT64,
+  parts_count        INT64,
+  total_words        INT64,
+  burden_sum         FLOAT64,
+  burden_count       INT64,
+  avg_burden         FLOAT64,
+  median_burden      FLOAT64,
+  max_burden         FLOAT64,
+  total_prohibitions INT64,
+  total_requirements INT64,
+  total_enforcement  INT64,
+  total_deadlines    INT64,
+  total_cost_refs    INT64
+)
+PARTITION BY version_date
+CLUSTER BY agency_name;
+
+DELETE FROM {dataset}.agency_metrics_daily
+WHERE {dates_filter};
+
+INSERT INTO {dataset}.agency_metrics_daily
+SELECT
+  version_date,
+  agency_name,
+  COUNT(*) AS sections_count,
+  COUNT(DISTINCT part_num) AS parts_count,
+  SUM(word_count) AS total_words,
+  SUM(regulatory_burden_score) AS burden_sum,
+  COUNT(regulatory_burden_score) AS burden_count,
+  AVG(regulatory_burden_score) AS avg_burden,
+  APPROX_QUANTILES(regulatory_burden_score, 2)[SAFE_OFFSET(1)] AS median_burden,
+  MAX(regulatory_burden_score) AS max_burden,
+  SUM(prohibition_count) AS total_prohibitions,
+  SUM(requirement_count) AS total_requirements,
+  SUM(enforcement_terms) AS total_enforcement,
+  SUM(temporal_references) AS total_deadlines,
+  SUM(dollar_mentions) AS total_cost_refs
+FROM {dataset}.{table}
+WHERE {dates_filter}
+GROUP BY version_date, agency_name;
+    """.format(dataset=dataset_id, table=table_name, dates_filter=dates_filter)
+
+    scope = f"{len(version_dates)} date(s)" if version_dates is not None else "all dates"
+    print(f"Refreshing agency metrics in {dataset_id} for {scope}", file=sys.stderr)
+    client.query(script, job_config=job_config).result()
+
+def refresh_derived_tables(client: bigquery.Client, dataset_id: str, table_name: str,
+                           version_dates: Optional[List[str]] = None) -> None:
+    """Bring every derived table in dataset_id up to date with dataset_id.table_name
+    for the given snapshot dates, or for every date when None (after rewrites that
+    touch rows across dates)."""
+    refresh_part_hashes(client, dataset_id, table_name, version_dates)
+    refresh_agency_metrics(client, dataset_id, table_name, version_dates)
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Refresh the derived tables for a section table")
+    ap.add_argument("--project", help="GCP project (default: client default)")
+    ap.add_argument("--dataset", required=True, help="BigQuery dataset holding the section table")
+    ap.add_argument("--table", required=True, help="Section table name")
+    ap.add_argument("--dates", nargs="+", help="Snapshot dates (YYYY-MM-DD); default: all")
+    args = ap.parse_args()
+    client = bigquery.Client(project=args.project) if args.project else bigquery.Client()
+    refresh_derived_tables(client, args.dataset, args.table, args.dates)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,8 @@ from google.cloud.exceptions import NotFound
 from dotenv import load_dotenv
 from lxml import etree
 
+from derived_tables import SECTION_DIGEST_SQL, refresh_derived_tables, xor_hash_sql
+
 load_dotenv()
 
 BASE = "https://www.ecfr.gov/api"
@@ -671,6 +673,8 @@ def run_backfill(args) -> int:
             if args.bigquery and batch_rows:
                 load_data_to_bigquery(client, table_id, batch_rows)
                 total_processed += len(batch_rows)
+            if args.bigquery:
+                refresh_derived_tables(client, dataset_id, table_name, [date])
                 
         finally:
             if out_file:
@@ -762,7 +766,7 @@ def ensure_table_exists(client: bigquery.Client, table_id: str) -> None:
             type_=bigquery.TimePartitioningType.DAY,
             field="version_date"
         )
-        table.clustering_fields = ["title_num", "agency_name", "part_num"]
+        table.clustering_fields = ["title_num", "part_num", "agency_name"]
         
         client.create_table(table)
 
@@ -770,7 +774,7 @@ def create_rollup_tables(client: bigquery.Client, dataset_id: str) -> None:
     """Create the rollup tables (parts_daily and agency_daily)."""
     # Read and execute the views.sql content
     views_sql = """
--- Per-part daily rollup (deterministic content hash by ordered child hashes)
+-- Per-part daily rollup (order-independent XOR of citation-bound section hashes)
 CREATE OR REPLACE TABLE {dataset}.parts_daily AS
 SELECT
   version_date,
@@ -781,8 +785,8 @@ SELECT
   part_num, ANY_VALUE(part_label) AS part_label,
   ANY_VALUE(agency_name) AS agency_name,
   SUM(word_count) AS part_word_count,
-  TO_HEX(SHA256(STRING_AGG(section_hash, '' ORDER BY section_citation))) AS part_hash
-FROM {dataset}.sections
+  {part_hash} AS part_hash
+FROM (SELECT *, {section_digest} AS section_digest FROM {dataset}.sections)
 GROUP BY version_date, title_num, part_num;
 
 -- Per-agency daily rollup
@@ -792,10 +796,13 @@ SELECT
   agency_name,
   ANY_VALUE(snapshot_ts) AS snapshot_ts,
   SUM(part_word_count) AS agency_word_count,
-  TO_HEX(SHA256(STRING_AGG(part_hash, '' ORDER BY title_num, part_num))) AS agency_hash
+  {agency_hash} AS agency_hash
 FROM {dataset}.parts_daily
 GROUP BY version_date, agency_name;
-    """.format(dataset=dataset_id)
+    """.format(dataset=dataset_id,
+               section_digest=SECTION_DIGEST_SQL,
+               part_hash=xor_hash_sql("section_digest"),
+               agency_hash=xor_hash_sql("FROM_HEX(part_hash)"))
     
     print(f"Creating rollup tables in {dataset_id}", file=sys.stderr)
     queries = [q.strip() for q in views_sql.split(';') if q.strip()]
@@ -924,6 +931,8 @@ def main():
         # Load any remaining rows
         if args.bigquery and batch_rows:
             load_data_to_bigquery(client, table_id, batch_rows)
+        if args.bigquery:
+            refresh_derived_tables(client, dataset_id, table_name, [args.date])
             
         # Create rollup tables if requested
         if args.bigquery and args.create_rollups:
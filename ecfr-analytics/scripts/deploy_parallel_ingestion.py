@@ -14,6 +14,11 @@ from typing import List, Dict, Any, Optional
 import requests
 from google.cloud import bigquery
 from dotenv import load_dotenv
+import sys
+
+# Shared derived-table refresh (part hashes, agency metrics) from the ingestion package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ingestion"))
+from derived_tables import refresh_derived_tables
 
 try:
     import aiohttp
@@ -318,6 +323,11 @@ async def main():
                 if result.get("status") != "success":
                     print(f"   - Part {result.get('part')}: {result.get('error', 'Unknown error')}")
         
+        # Each function invocation only appends its part's rows; refresh the
+        # derived tables once for the date after all of them have landed
+        if successful:
+            refresh_derived_tables(bigquery.Client(project=PROJECT_ID), DATASET, TABLE, [args.date])
+        
         # Verify completeness
         stats = orchestrator.verify_data_completeness(args.title, args.date)
         
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Section Embedding Backfill
+Fills the `embedding` and binary-quantized `embedding_bits` columns of the
+enhanced sections table for the AI service's vector retrieval
+(see infra/sections_enhanced.sql)
+"""
+
+import os
+import sys
+import base64
+import argparse
+import vertexai
+from google.cloud import bigquery
+from dotenv import load_dotenv
+
+# Embed and quantize exactly as the AI service's query path does
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ai_service"))
+from embeddings import embed_documents, load_embedding_model, pack_embedding_bits
+
+load_dotenv()
+
+# Configuration
+PROJECT_ID = os.getenv("PROJECT_ID", "lawscan")
+REGION = os.getenv("REGION", "us-central1")
+DATASET = os.getenv("DATASET", "ecfr_enhanced")
+TABLE = os.getenv("TABLE", "sections_enhanced")
+
+def fetch_pending(client, version_date, limit):
+    """Sections for the date that have no embedding yet."""
+    sql = f"""
+    SELECT section_citation, COALESCE(embedding_optimized_text, section_text, '') AS text
+    FROM `{PROJECT_ID}.{DATASET}.{TABLE}`
+    WHERE version_date = @date AND (ARRAY_LENGTH(embedding) = 0 OR embedding_bits IS NULL)
+    LIMIT @limit
+    """
+    return list(client.query_and_wait(sql, job_config=bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("date", "DATE", version_date),
+        bigquery.ScalarQueryParameter("limit", "INT64", limit),
+    ])))
+
+def write_embeddings(client, version_date, citations, vectors):
+    """Stage the vectors and merge them into the sections table in one DML statement."""
+    staging_id = f"{PROJECT_ID}.{DATASET}._embedding_staging"
+    client.load_table_from_json(
+        [{"section_citation": c, "embedding": v, "embedding_bits": base64.b64encode(pack_embedding_bits(v)).decode()}
+         for c, v in dict(zip(citations, vectors)).items()],
+        staging_id,
+        job_config=bigquery.LoadJobConfig(
+            schema=[
+                bigquery.SchemaField("section_citation", "STRING"),
+                bigquery.SchemaField("embedding", "FLOAT64", mode="REPEATED"),
+                bigquery.SchemaField("embedding_bits", "BYTES"),
+            ],
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        ),
+    ).result()
+    sql = f"""
+    MERGE `{PROJECT_ID}.{DATASET}.{TABLE}` t
+    USING `{staging_id}` s
+    ON t.version_date = @date AND t.section_citation = s.section_citation
+    WHEN MATCHED THEN UPDATE SET embedding = s.embedding, embedding_bits = s.embedding_bits
+    """
+    client.query_and_wait(sql, job_config=bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("date", "DATE", version_date),
+    ]))
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill section embeddings for vector search")
+    parser.add_argument("--date", required=True, help="Version date YYYY-MM-DD")
+    parser.add_argument("--chunk", type=int, default=2000, help="Sections fetched and merged per round")
+    parser.add_argument("--batch-size", type=int, default=50, help="Texts per embedding request (model max 250)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Embedding requests in flight")
+    args = parser.parse_args()
+
+    vertexai.init(project=PROJECT_ID, location=REGION)
+    model = load_embedding_model()
+    client = bigquery.Client(project=PROJECT_ID)
+
+    total = 0
+    while True:
+        rows = fetch_pending(client, args.date, args.chunk)
+        if not rows:
+            break
+        citations = [row["section_citation"] for row in rows]
+        vectors = embed_documents(model, [row["text"] for row in rows], args.batch_size, args.concurrency)
+        write_embeddings(client, args.date, citations, vectors)
+        total += len(rows)
+        print(f"  ✅ Embedded {total} sections for {args.date}")
+
+    print(f"Done: {total} sections embedded")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
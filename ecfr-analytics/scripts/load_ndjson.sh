@@ -13,3 +13,6 @@ TABLE=$3
 FILE=$4
 
 bq --project_id "${PROJECT}" load   --source_format=NEWLINE_DELIMITED_JSON   --replace=false   "${DATASET}.${TABLE}"   "${FILE}"
+
+# Bring the derived tables (part hashes, agency metrics) in line with the rows just loaded
+python "$(dirname "$0")/../ingestion/derived_tables.py" --project "${PROJECT}" --dataset "${DATASET}" --table "${TABLE}"
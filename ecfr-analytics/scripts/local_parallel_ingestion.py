@@ -18,6 +18,11 @@ from google.cloud import bigquery
 from dotenv import load_dotenv
 from lxml import etree
 import re
+import sys
+
+# Shared derived-table refresh (part hashes, agency metrics) from the ingestion package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ingestion"))
+from derived_tables import refresh_derived_tables
 
 load_dotenv()
 
@@ -285,7 +290,9 @@ def process_section(section_node: Dict, title_data: Dict, part_data: Dict,
         "section_num": section_num,
         "section_citation": section_citation,
         "section_heading": section_heading,
+        "section_heading_norm": re.sub(r"[^a-z0-9 ]", "", (section_heading or "").lower()),  # Matched by the AI service's relevance scoring
         "section_text": section_text,
+        "section_text_preview": section_text[:1000],  # What the AI service reads for chat context
         "reserved": section_node.get("reserved", False),
         "agency_name": agency_name,
         "references": [],
@@ -420,6 +427,10 @@ def insert_to_bigquery_batch(all_sections: List[Dict[str, Any]], project_id: str
         job = client.load_table_from_json(batch, table_ref, job_config=job_config)
         job.result()  # Wait for completion
         print(f"✅ Inserted batch {i//batch_size + 1}: {len(batch)} sections")
+    
+    # Replacing a title deletes its rows on every date, so every date's rollups move
+    dates = None if replace_title and title_num else sorted({s["version_date"] for s in all_sections})
+    refresh_derived_tables(client, dataset, table, dates)
 
 def run_local_parallel_ingestion(title: int, date: str = "2025-08-22", max_workers: int = None, 
                                 dry_run: bool = False, verify: bool = True) -> Dict[str, Any]:
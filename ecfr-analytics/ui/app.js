@@ -1143,6 +1143,35 @@ function addMessage(content, isUser = false, sources = []) {
   
   // Scroll to bottom
   messagesContainer.scrollTop = messagesContainer.scrollHeight;
+  
+  return messageDiv;
+}
+
+// Read a text/event-stream response, calling onEvent(event, data) for each event
+async function readEventStream(response, onEvent) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    
+    let boundary;
+    while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      
+      let event = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      onEvent(event, data ? JSON.parse(data) : {});
+    }
+  }
 }
 
 // Add typing indicator
@@ -1210,7 +1239,8 @@ async function sendMessage() {
   addTypingIndicator();
   
   try {
-    const response = await fetch(`${AI_API_BASE}/chat`, {
+    // Stream the answer: sources arrive first, then the text in chunks
+    const response = await fetch(`${AI_API_BASE}/chat/stream`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -1227,18 +1257,39 @@ async function sendMessage() {
       throw new Error(`AI service error: ${response.status}`);
     }
     
-    const result = await response.json();
-    
-    // Remove typing indicator
-    removeTypingIndicator();
+    const messagesContainer = document.getElementById('chat-messages');
+    let aiResponse = '';
+    let responseText = null;
+    let suggestions = [];
+    
+    await readEventStream(response, (event, data) => {
+      if (event === 'sources') {
+        // Remove typing indicator and show citations while the answer generates
+        removeTypingIndicator();
+        responseText = addMessage('', false, data.sources).querySelector('.whitespace-pre-wrap');
+        suggestions = data.suggestions || [];
+        
+        if (data.sources && data.sources.length > 0) {
+          showSources(data.sources);
+        }
+      } else if (event === 'message') {
+        aiResponse += data.text;
+        responseText.innerHTML = aiResponse;
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+      } else if (event === 'error') {
+        throw new Error(data.detail);
+      }
+    });
     
-    // Add AI response
-    addMessage(result.response, false, result.sources);
+    // Questions too vague to search come back with example questions
+    if (suggestions.length > 0) {
+      responseText.innerHTML = `${aiResponse}\n\nTry asking:\n${suggestions.map(s => `• ${s}`).join('\n')}`;
+    }
     
     // Update conversation history
     conversationHistory.push({
       user: message,
-      assistant: result.response
+      assistant: aiResponse
     });
     
     // Keep only last 10 exchanges to manage context size
@@ -1246,11 +1297,6 @@ async function sendMessage() {
       conversationHistory = conversationHistory.slice(-10);
     }
     
-    // Show sources if available
-    if (result.sources && result.sources.length > 0) {
-      showSources(result.sources);
-    }
-    
   } catch (err) {
     console.error('Chat error:', err);
     removeTypingIndicator();